@@ -0,0 +1,141 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Logging off the IOLoop thread. QueueHandler appends records to a bounded queue, and a writer thread wakes up every
+interval seconds, takes them off in batches and writes them through the target handler (e.g. a
+TimedRotatingFileHandler): one rollover check, one write and one flush per batch instead of per record. The queue is a
+deque, appending takes no lock and wakes no thread. The calling thread only renders the message (and the traceback, if
+any), so arguments may change after the call and traceback frames are not kept alive.
+
+When the queue is full records are dropped and counted, a full disk or a burst of errors slows nothing down; the
+writer logs how many were dropped. logging.shutdown() at exit closes the handler, which writes what is queued.
+
+handler = QueueHandler(logging.handlers.TimedRotatingFileHandler(path, "D", 1))
+logger.addHandler(handler)
+'''
+
+import os
+import logging
+import logging.handlers
+import threading
+import collections
+
+
+class QueueHandler(logging.Handler):
+    '''
+    Args:
+      target: handler writing the records, its formatter formats them.
+      max_size: most records waiting to be written, further ones are dropped.
+      batch_size: most records written at once.
+      interval: seconds the writer sleeps when the queue is empty, the most a record waits to be written.
+    '''
+
+    def __init__(self, target, max_size=10000, batch_size=500, interval=0.05):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self._reported = 0
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _start(self):
+        # the writer thread does not survive a fork, a process starts its own on its first record.
+        self._pid = os.getpid()
+        self._queue = collections.deque()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._queue, self._stopping), name='log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        try:
+            if self._pid != os.getpid():
+                self._start()
+            if len(self._queue) >= self.max_size:
+                self.dropped += 1
+                return
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = (self.target.formatter or logging._defaultFormatter).formatException(
+                    record.exc_info)
+                record.exc_info = None
+            self._queue.append(record)
+            self.queued += 1
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def _run(self, queue, stopping):
+        while True:
+            stop = stopping.is_set()
+            records = []
+            try:
+                while len(records) < self.batch_size:
+                    records.append(queue.popleft())
+            except IndexError:
+                pass
+            if self.dropped != self._reported:
+                dropped, self._reported = self.dropped - self._reported, self.dropped
+                records.append(logging.makeLogRecord({
+                    'name': records[-1].name if records else 'websetup', 'levelno': logging.WARNING,
+                    'levelname': 'WARNING', 'msg': 'log queue full, %d records dropped' % dropped}))
+            if records:
+                self._write(records)
+            if len(records) < self.batch_size:
+                if stop and not queue:
+                    return
+                stopping.wait(self.interval)
+
+    def _write(self, records):
+        target = self.target
+        try:
+            if isinstance(target, logging.handlers.BaseRotatingHandler) and target.shouldRollover(records[0]):
+                target.doRollover()
+            if isinstance(target, logging.StreamHandler):
+                lines = []
+                for r in records:
+                    s = target.format(r)
+                    lines.append(s.encode('utf-8') if isinstance(s, unicode) else s)
+                if target.stream is None:
+                    target.stream = target._open()
+                target.stream.write('\n'.join(lines) + '\n')
+                target.flush()
+            else:
+                for r in records:
+                    target.handle(r)
+        except Exception:
+            target.handleError(records[-1])
+        self.written += len(records)
+        self.batches += 1
+
+    def _stop(self):
+        # write what is queued and stop the writer, the next record starts a new one.
+        if self._pid == os.getpid():
+            self._pid = None
+            self._stopping.set()
+            self._thread.join(5)
+
+    def flush(self):
+        '''
+        Block until the records queued so far are written.
+        '''
+        self._stop()
+
+    def close(self):
+        self._stop()
+        logging.Handler.close(self)
+
+    def stats(self):
+        from utils import Dict  # utils imports config, which creates this handler.
+        return Dict(queued=self.queued, written=self.written, batches=self.batches, dropped=self.dropped,
+                    pending=len(self._queue) if self._queue is not None else 0)
@@ -0,0 +1,78 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Offline benchmarks, run from the project root, e.g. python -m bench.sql_cache
+'''
+
+import time
+import atexit
+import socket
+
+# the user table of the application, for benchmarks on sqlite3.
+USER_TABLE_DDL = ('create table user (pid integer primary key, userName text, loginName text unique, loginPwd text, '
+                  'age integer)')
+
+
+def free_port():
+    '''
+    Return a TCP port of 127.0.0.1 that is free now.
+    '''
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def start_standin():
+    '''
+    Start the redis stand-in, point config.redis_param at it and stop it at exit. Returns the RedisStandin.
+    '''
+    import config
+    from bench.redis_standin import RedisStandin
+    standin = RedisStandin().start()
+    config.redis_param['port'] = standin.port
+    atexit.register(standin.stop)
+    return standin
+
+
+def measure(func, number=10000, repeat=5):
+    '''
+    Call func() number times, repeat times, and return the best time per call in microseconds.
+    '''
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        for j in xrange(number):
+            func()
+        t = (time.time() - start) / number
+        if best is None or t < best:
+            best = t
+    return best * 1e6
+
+
+def calibrate(func, min_time=0.2):
+    '''
+    Return how many calls of func take at least min_time seconds, so that a case of a few microseconds is timed over
+    enough calls to be stable. The calibrating runs warm the case up.
+    '''
+    number = 1
+    while True:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            return number
+        number *= min(10, max(2, int(min_time / elapsed) + 1)) if elapsed > 0 else 10
+
+
+def report(title, results):
+    '''
+    Print (name, us per call) pairs, with the speed-up of each line against the first one.
+    '''
+    print title
+    base = results[0][1]
+    for name, us in results:
+        print '  %-40s %10.3f us  x%.2f' % (name, us, base / us if us else 0)
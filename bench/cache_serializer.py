@@ -0,0 +1,54 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Size and encode/decode time of cache payloads: the old default pickle against the Serializer codecs.
+python -m bench.cache_serializer
+'''
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from bench import measure
+from utils import Dict
+from serializer import Serializer, msgpack, lz4
+
+
+def _user():
+    return Dict(('pid', 'userName', 'loginName', 'loginPwd', 'age'),
+                (10086, u'程浩', u'chenghao', u'pbkdf2_sha256$100000$c2FsdA$aGFzaA', 28))
+
+
+def _session():
+    # a session: the user row plus some request history.
+    return Dict(user=_user(), created=1476779300.25, last_seen=1476781100.5, ip='10.0.3.17',
+                visits=[Dict(path=u'/websetup/user/info', t=1476779300 + i) for i in xrange(30)])
+
+
+def main():
+    cases = [('pickle protocol 0 (old)', None)]
+    cases.append(('pickle', Serializer('pickle', None)))
+    cases.append(('pickle + zlib', Serializer('pickle', 'zlib', 256)))
+    cases.append(('json', Serializer('json', None)))
+    cases.append(('json + zlib', Serializer('json', 'zlib', 256)))
+    if msgpack is not None:
+        cases.append(('msgpack', Serializer('msgpack', None)))
+        cases.append(('msgpack + zlib', Serializer('msgpack', 'zlib', 256)))
+    if lz4 is not None:
+        cases.append(('pickle + lz4', Serializer('pickle', 'lz4', 256)))
+    for title, value in (('user row', _user()), ('session', _session())):
+        print title
+        print '  %-26s %8s %12s %12s' % ('format', 'bytes', 'dumps us', 'loads us')
+        for name, s in cases:
+            if s is None:
+                dumps, loads = pickle.dumps, pickle.loads
+            else:
+                dumps, loads = s.dumps, s.loads
+            payload = dumps(value)
+            print '  %-26s %8d %12.2f %12.2f' % (name, len(payload), measure(lambda: dumps(value), 2000),
+                                                 measure(lambda: loads(payload), 2000))
+
+
+if __name__ == '__main__':
+    main()
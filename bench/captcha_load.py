@@ -0,0 +1,153 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Login latency with and without concurrent captcha traffic, for each captcha render path. The server runs in a child
+process on sqlite3 and the redis stand-in, the clients in this one.
+python -m bench.captcha_load [seconds]
+'''
+
+import os
+import sys
+import json
+import logging
+import time
+import signal
+import urllib
+import tempfile
+import config
+from tornado import gen, ioloop
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from bench import USER_TABLE_DDL, free_port, start_standin
+
+LOGIN_CLIENTS = 4
+CAPTCHA_CLIENTS = 16
+# PBKDF2 iterations of the server: low, so login latency shows the captcha contention and not the password hash.
+ITERATIONS = 1000
+
+SCENARIOS = [
+    # (name, captcha clients, captcha_pool_param, captcha_render_param)
+    ('login only', 0, None, None),
+    ('captcha inline', CAPTCHA_CLIENTS, None, None),
+    ('captcha process pool', CAPTCHA_CLIENTS, None, {"processes": 2, "max_pending": 8}),
+    ('captcha pool + process pool', CAPTCHA_CLIENTS, config.captcha_pool_param, config.captcha_render_param),
+]
+
+
+def serve(port, pool_param, render_param):
+    '''
+    Run the application in this process until killed.
+    '''
+    import tornado.httpserver
+
+    start_standin()
+    config.captcha_pool_param = pool_param
+    config.captcha_render_param = render_param
+    import start
+    import passwords
+    from db import dbutil
+    from ratelimit import limiter
+
+    # all requests come from one ip, the limits would answer most of them with 429.
+    limiter.rules = dict((rule, {}) for rule in limiter.rules)
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    dbutil.init('sqlite3', path, None, pool_max_size=20)
+    dbutil.update(USER_TABLE_DDL)
+    passwords.hasher.iterations = ITERATIONS
+    for i in xrange(100):
+        dbutil.insert('user', userName='user%d' % i, loginName='login%d' % i,
+                      loginPwd=passwords.make_hash('pwd%d' % i, ITERATIONS), age=20)
+    # the handlers of start.Application, with its cookie secret for the login sessions, logging at WARNING.
+    app = start.make_app('bench')
+    # the log file only, IOLoop.start() would otherwise add a stderr handler to the root logger.
+    logging.getLogger().addHandler(logging.NullHandler())
+    # a loop of our own, not the one inherited from the parent.
+    loop = ioloop.IOLoop()
+    loop.make_current()
+    tornado.httpserver.HTTPServer(app).listen(port, '127.0.0.1')
+    loop.start()
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0
+
+
+@gen.coroutine
+def _drive(port, captcha_clients, seconds):
+    base = 'http://127.0.0.1:%d%s' % (port, config.url_prefix)
+    client = AsyncHTTPClient(max_clients=LOGIN_CLIENTS + captcha_clients)
+    latencies = {'login': [], 'captcha': []}
+    errors = {'login': 0, 'captcha': 0}
+    deadline = time.time() + seconds
+
+    @gen.coroutine
+    def worker(name, i):
+        n = 0
+        while time.time() < deadline:
+            n += 1
+            if name == 'login':
+                body = urllib.urlencode({'loginName': 'login%d' % (n % 100), 'loginPwd': 'pwd%d' % (n % 100)})
+                request = HTTPRequest(base + '/user/login', 'POST', body=body)
+            else:
+                request = HTTPRequest(base + '/verCode?imei=bench%d_%d' % (i, n))
+            started = time.time()
+            response = yield client.fetch(request, raise_error=False)
+            if response.code == 200:
+                latencies[name].append(time.time() - started)
+            else:
+                errors[name] += 1
+
+    yield [worker('login', i) for i in xrange(LOGIN_CLIENTS)] + \
+          [worker('captcha', i) for i in xrange(captcha_clients)]
+    raise gen.Return(dict((name, {
+        'requests': len(latencies[name]),
+        'errors': errors[name],
+        'p50_ms': round(_percentile(latencies[name], 0.5), 2),
+        'p99_ms': round(_percentile(latencies[name], 0.99), 2),
+    }) for name in latencies if latencies[name] or errors[name]))
+
+
+@gen.coroutine
+def _wait_ready(port):
+    client = AsyncHTTPClient()
+    for i in xrange(100):
+        response = yield client.fetch('http://127.0.0.1:%d%s/user/login' % (port, config.url_prefix),
+                                      raise_error=False)
+        if response.code != 599:
+            return
+        yield gen.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    results = []
+    for name, captcha_clients, pool_param, render_param in SCENARIOS:
+        port = free_port()
+        pid = os.fork()
+        if pid == 0:
+            # own process group, so the render workers are killed with the server.
+            os.setpgid(0, 0)
+            try:
+                serve(port, pool_param, render_param)
+            finally:
+                os._exit(0)
+        try:
+            loop = ioloop.IOLoop.current()
+            loop.run_sync(lambda: _wait_ready(port))
+            # warm up the statement, query and render caches.
+            loop.run_sync(lambda: _drive(port, captcha_clients, 1))
+            results.append((name, loop.run_sync(lambda: _drive(port, captcha_clients, seconds))))
+        finally:
+            os.killpg(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+    print 'login p99 with %d login clients and %d captcha clients, %gs each' % (LOGIN_CLIENTS, CAPTCHA_CLIENTS,
+                                                                                 seconds)
+    for name, r in results:
+        print '  %-30s %s' % (name, json.dumps(r, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Captcha pool: cost of VerCode taking an entry from the pool against rendering inline, and how the pool behaves
+under a burst larger than it holds.
+python -m bench.captcha_pool
+'''
+
+import time
+import captcha
+from bench import measure, report
+
+
+def main():
+    pool = captcha.CaptchaPool(size=1000, low_water=300, batch=50, processes=2, rate=0).start()
+    started = time.time()
+    while pool.stats().depth < pool.size:
+        time.sleep(0.01)
+    print 'filled %d entries in %.2fs' % (pool.size, time.time() - started)
+
+    report('one captcha for VerCode', [
+        ('render inline', measure(captcha.generate, 200)),
+        ('pop from pool', measure(pool.pop, 500, 1)),
+    ])
+
+    # a burst of 3000 requests over ~1.5s, with the pool refilling behind it.
+    started = time.time()
+    for i in xrange(3000):
+        pool.pop()
+        time.sleep(0.0005)
+    print 'burst of 3000 in %.2fs: %s' % (time.time() - started, pool.stats())
+    pool.close()
+
+
+if __name__ == '__main__':
+    main()
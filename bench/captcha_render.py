@@ -0,0 +1,67 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+CPU per captcha image: the PIL drawing VerCode used to do against captcha.CaptchaRenderer.
+python -m bench.captcha_render [out_dir]    # also writes sample images to compare the visual difficulty
+'''
+
+import os
+import sys
+import random
+import StringIO
+from PIL import Image, ImageDraw, ImageFont
+import config
+import captcha
+from bench import measure, report
+
+
+def legacy_render(code):
+    '''
+    The former VerCode.get drawing code.
+    '''
+    img_size = (90, 40)
+    width, height = img_size
+    im = Image.new('RGBA', img_size, (255, 255, 255))
+    draw = ImageDraw.Draw(im)
+    font = ImageFont.truetype(config.font_type.replace("\\", "/"), 40)
+    for i in xrange(200):
+        x1 = random.randint(0, width)
+        y1 = random.randint(0, height)
+        x2 = random.randint(0, width)
+        y2 = random.randint(0, height)
+        fill = (random.randint(130, 250), random.randint(130, 250), random.randint(130, 250))
+        draw.line(((x1, y1), (x2, y2)), fill=fill)
+    x = 5
+    y = 2
+    for word in code:
+        fill = (random.randint(0, 130), random.randint(0, 130), random.randint(0, 130))
+        draw.text((x, y), word, font=font, fill=fill)
+        x += 20
+    for i in xrange(1000):
+        x1 = random.randint(0, width - 1)
+        y1 = random.randint(0, height - 1)
+        fill = (random.randint(20, 250), random.randint(20, 250), random.randint(20, 250))
+        im.putpixel((x1, y1), fill)
+    mem = StringIO.StringIO()
+    im.convert('RGB').save(mem, "JPEG")
+    return mem.getvalue()
+
+
+def main():
+    renderer = captcha.get_renderer()
+    report('render one captcha', [
+        ('PIL drawing (old VerCode)', measure(lambda: legacy_render(captcha.random_code()), 100)),
+        ('CaptchaRenderer', measure(lambda: renderer.render(captcha.random_code()), 100)),
+    ])
+    if len(sys.argv) > 1:
+        out = sys.argv[1]
+        for i in xrange(5):
+            code = captcha.random_code()
+            open(os.path.join(out, 'old_%s.jpg' % code), 'wb').write(legacy_render(code))
+            open(os.path.join(out, 'new_%s.jpg' % code), 'wb').write(renderer.render(code))
+        print 'sample images written to %s' % out
+
+
+if __name__ == '__main__':
+    main()
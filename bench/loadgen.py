@@ -0,0 +1,268 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+End-to-end load test of the real endpoints: login, register and verCode. The Application of start.py runs in a child
+process on sqlite3 and the redis stand-in (or --url points at a running server), and is driven by AsyncHTTPClient.
+
+With --rate, requests of every endpoint arrive open loop, at random (Poisson) times averaging rate per second,
+whether earlier ones have finished or not, and latency counts from the time a request was due: a slow server shows
+as latency and not as a lower request rate. At most --concurrency requests per endpoint are in flight, due requests
+above that are counted as dropped. With --rate 0, --concurrency clients per endpoint send requests back to back.
+
+Per endpoint the report has throughput, p50/p90/p99/p999 latency and error rates, printed and written as JSON.
+python -m bench.loadgen --rate 20 --duration 30 --out load.json
+python -m bench.loadgen --endpoints login --rate 0 --concurrency 8
+'''
+
+import os
+import json
+import time
+import random
+import signal
+import itertools
+import urllib
+import logging
+import argparse
+import platform
+import tempfile
+import config
+from tornado import gen, ioloop
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from bench import USER_TABLE_DDL, free_port, start_standin
+
+PASSWORD = 'load-pwd'
+ENDPOINTS = ('login', 'register', 'verCode')
+
+# login names registered by this run, unique across runs against the same --url server.
+_run_id = '%x%x' % (int(time.time()), os.getpid())
+_registered = itertools.count()
+
+
+def serve(port, args):
+    '''
+    Run start.make_app(args.profile) in this process until killed, on a sqlite3 database of args.users users.
+    '''
+    import tornado.httpserver
+
+    start_standin()
+    import start
+    import bloom
+    import passwords
+    from db import dbutil
+    from ratelimit import limiter
+
+    path = os.path.join(tempfile.mkdtemp(), 'loadgen.db')
+    dbutil.init('sqlite3', path, None, pool_max_size=args.db_connections)
+    dbutil.update(USER_TABLE_DDL)
+    iterations = args.iterations or passwords.hasher.iterations
+    passwords.hasher.iterations = iterations
+    # one salt for all seeded users, a hash each would take minutes.
+    pwd = passwords.make_hash(PASSWORD, iterations)
+    dbutil.insert_many('user', [dict(userName=u'user%d' % i, loginName='load%d' % i, loginPwd=pwd, age=20 + i % 50)
+                                for i in xrange(args.users)])
+    dbutil.init_query_cache(**config.query_cache_param)
+    bloom.init_login_names()
+    if not args.rate_limits:
+        # all requests come from one ip, the limits would answer most of them with 429.
+        limiter.rules = dict((rule, {}) for rule in limiter.rules)
+
+    app = start.make_app(args.profile)
+    # the log file only, IOLoop.start() would otherwise add a stderr handler to the root logger.
+    logging.getLogger().addHandler(logging.NullHandler())
+    # a loop of our own, not the one inherited from the parent.
+    loop = ioloop.IOLoop()
+    loop.make_current()
+    tornado.httpserver.HTTPServer(app).listen(port, '127.0.0.1')
+    loop.start()
+
+
+def _request(base, endpoint, n, args):
+    if endpoint == 'login':
+        body = urllib.urlencode({'loginName': 'load%d' % random.randrange(args.users), 'loginPwd': PASSWORD})
+        return HTTPRequest(base + '/user/login', 'POST', body=body, request_timeout=args.timeout)
+    if endpoint == 'register':
+        body = urllib.urlencode({'loginName': 'reg%s_%d' % (_run_id, next(_registered)),
+                                 'loginPwd': PASSWORD, 'userName': 'load', 'age': 30})
+        return HTTPRequest(base + '/user/register', 'POST', body=body, request_timeout=args.timeout)
+    return HTTPRequest(base + '/verCode?imei=load%d' % n, request_timeout=args.timeout)
+
+
+def _ok(endpoint, response):
+    if response.code != 200:
+        return False
+    if endpoint == 'verCode':
+        return True
+    try:
+        return json.loads(response.body)['status'] == 0
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+class _Stats(object):
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.dropped = 0
+        self.codes = {}
+
+    def add(self, endpoint, response, latency):
+        code = str(response.code)
+        self.codes[code] = self.codes.get(code, 0) + 1
+        if _ok(endpoint, response):
+            self.latencies.append(latency)
+        else:
+            self.errors += 1
+
+    def report(self, seconds):
+        values = sorted(self.latencies)
+        done = len(values) + self.errors
+
+        def percentile(p):
+            return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2) if values else None
+
+        return {
+            'requests': done,
+            'ok': len(values),
+            'errors': self.errors,
+            'error_rate': round(float(self.errors) / done, 4) if done else 0.0,
+            'dropped': self.dropped,
+            'throughput': round(len(values) / seconds, 2),
+            'p50_ms': percentile(0.5),
+            'p90_ms': percentile(0.9),
+            'p99_ms': percentile(0.99),
+            'p999_ms': percentile(0.999),
+            'max_ms': round(values[-1] * 1000, 2) if values else None,
+            'codes': self.codes,
+        }
+
+
+@gen.coroutine
+def _drive(base, args, seconds):
+    '''
+    Send load for seconds, return {endpoint: report}.
+    '''
+    client = AsyncHTTPClient(force_instance=True, max_clients=args.concurrency * len(args.endpoints))
+    stats = dict((e, _Stats()) for e in args.endpoints)
+    started = time.time()
+    deadline = started + seconds
+
+    @gen.coroutine
+    def closed_loop(endpoint, i):
+        n = i
+        while time.time() < deadline:
+            n += args.concurrency
+            sent = time.time()
+            response = yield client.fetch(_request(base, endpoint, n, args), raise_error=False)
+            stats[endpoint].add(endpoint, response, time.time() - sent)
+
+    @gen.coroutine
+    def open_loop(endpoint):
+        s = stats[endpoint]
+        pending = set()
+        due = started
+        n = 0
+        while True:
+            due += random.expovariate(args.rate)
+            if due >= deadline:
+                break
+            yield gen.sleep(max(0.0, due - time.time()))
+            n += 1
+            if len(pending) >= args.concurrency:
+                s.dropped += 1
+                continue
+            f = client.fetch(_request(base, endpoint, n, args), raise_error=False)
+            pending.add(f)
+
+            def done(f, due=due):
+                pending.discard(f)
+                s.add(endpoint, f.result(), time.time() - due)
+
+            ioloop.IOLoop.current().add_future(f, done)
+        while pending:
+            yield gen.sleep(0.01)
+
+    if args.rate:
+        yield [open_loop(e) for e in args.endpoints]
+    else:
+        yield [closed_loop(e, i) for e in args.endpoints for i in xrange(args.concurrency)]
+    elapsed = time.time() - started
+    client.close()
+    raise gen.Return(dict((e, s.report(elapsed)) for e, s in stats.iteritems()))
+
+
+@gen.coroutine
+def _wait_ready(base):
+    client = AsyncHTTPClient()
+    for i in xrange(300):
+        response = yield client.fetch(base + '/user/login', raise_error=False)
+        if response.code != 599:
+            return
+        yield gen.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='end-to-end load test of login, register and verCode')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='comma separated, default all')
+    parser.add_argument('--rate', type=float, default=10, help='requests per second per endpoint, open loop; '
+                                                                '0 for closed loop (default 10)')
+    parser.add_argument('--concurrency', type=int, default=16, help='most requests in flight per endpoint')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of measured load (default 10)')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of load before measuring (default 2)')
+    parser.add_argument('--timeout', type=float, default=20, help='request timeout in seconds (default 20)')
+    parser.add_argument('--out', metavar='FILE', help='also write the JSON report to FILE')
+    parser.add_argument('--url', help='load a running server instead, e.g. http://127.0.0.1:7777/websetup; '
+                                      'its users must be load0.. with password ' + PASSWORD)
+    parser.add_argument('--profile', default='bench', help='application profile of the started server')
+    parser.add_argument('--users', type=int, default=1000, help='users seeded in the started server')
+    parser.add_argument('--iterations', type=int, default=0, help='PBKDF2 iterations of the started server, '
+                                                                  'default config.password_param')
+    parser.add_argument('--db-connections', type=int, default=10, help='sqlite connections of the started server')
+    parser.add_argument('--rate-limits', action='store_true', help='keep config.rate_limits in the started server')
+    args = parser.parse_args()
+    args.endpoints = [e for e in args.endpoints.split(',') if e]
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error('unknown endpoints: ' + ', '.join(sorted(unknown)))
+
+    pid = None
+    if args.url:
+        base = args.url.rstrip('/')
+    else:
+        port = free_port()
+        base = 'http://127.0.0.1:%d%s' % (port, config.url_prefix)
+        pid = os.fork()
+        if pid == 0:
+            # own process group, so the captcha and hashing workers are killed with the server.
+            os.setpgid(0, 0)
+            try:
+                serve(port, args)
+            finally:
+                os._exit(0)
+    try:
+        loop = ioloop.IOLoop.current()
+        loop.run_sync(lambda: _wait_ready(base))
+        if args.warmup:
+            loop.run_sync(lambda: _drive(base, args, args.warmup))
+        endpoints = loop.run_sync(lambda: _drive(base, args, args.duration))
+    finally:
+        if pid:
+            os.killpg(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': platform.platform(),
+        'python': platform.python_version(),
+        'args': vars(args),
+        'endpoints': endpoints,
+    }
+    print json.dumps(report, indent=2, sort_keys=True, separators=(',', ': '))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True, separators=(',', ': '))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Cost of a log call on the calling thread: file handler written inline against asynclog.QueueHandler, and eager
+against lazy formatting of a dropped DEBUG record.
+python -m bench.log_queue
+'''
+
+import os
+import logging
+import logging.handlers
+import tempfile
+from bench import measure, report
+import config  # the logging settings of the app
+from asynclog import QueueHandler
+
+SQL = 'select pid, userName, loginName, loginPwd, age from user where loginName=?'
+
+
+def _logger(name, handler):
+    handler.setFormatter(logging.Formatter('%(asctime)s %(name)-5s %(levelname)-5s %(message)s'))
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def main():
+    d = tempfile.mkdtemp()
+    inline = _logger('bench.inline', logging.handlers.TimedRotatingFileHandler(os.path.join(d, 'inline'), 'D', 1))
+    queued_handler = QueueHandler(logging.handlers.TimedRotatingFileHandler(os.path.join(d, 'queued'), 'D', 1),
+                                  max_size=100000)
+    queued = _logger('bench.queued', queued_handler)
+    # the writer sleeps through the measure: what the calling thread pays, the writer's share of a core aside.
+    idle_handler = QueueHandler(logging.handlers.TimedRotatingFileHandler(os.path.join(d, 'idle'), 'D', 1),
+                                max_size=100000, interval=60)
+    idle = _logger('bench.idle', idle_handler)
+    args = ('bob', 3)
+    report('logger.info', [
+        ('file handler, inline', measure(lambda: inline.info('SQL: %s, ARGS: %s', SQL, args), 10000, 3)),
+        ('QueueHandler', measure(lambda: queued.info('SQL: %s, ARGS: %s', SQL, args), 10000, 3)),
+        ('QueueHandler, writer idle', measure(lambda: idle.info('SQL: %s, ARGS: %s', SQL, args), 10000, 3)),
+    ])
+    idle_handler.flush()
+    queued_handler.flush()
+    print '  queued %d, written %d in %d batches, dropped %d' % (
+        queued_handler.queued, queued_handler.written, queued_handler.batches, queued_handler.dropped)
+    report('logger.debug, level INFO', [
+        ('eager %', measure(lambda: queued.debug('SQL: %s, ARGS: %s' % (SQL, args)), 100000, 3)),
+        ('lazy args', measure(lambda: queued.debug('SQL: %s, ARGS: %s', SQL, args), 100000, 3)),
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+bloom.init_login_names, in-process and shared: checks that every seeded name is reported, that the false positive
+rate of absent names stays near error_rate, that a shared filter is reused by a second worker and sees the names
+it adds, then the cost of a lookup. Exits 1 when a check fails.
+python -m bench.login_filter           # in-process stand-in
+python -m bench.login_filter 6379      # redis-server on localhost:6379
+'''
+
+import os
+import sys
+import tempfile
+import config
+from bench import USER_TABLE_DDL, measure, report, start_standin
+
+N = 2000
+
+
+def check_filter(f, names, absent, error_rate):
+    '''
+    Return the list of (what, expected, got) that differ for filter f built from names.
+    '''
+    wrong = []
+    missing = [n for n in names if not f.contains(n).result()]
+    if missing:
+        wrong.append(('seeded names', 'all found', '%d missing' % len(missing)))
+    hits = sum(1 for n in absent if f.contains(n).result())
+    if hits > 3 * error_rate * len(absent) + 5:
+        wrong.append(('false positives', '<= %.3f' % (3 * error_rate), '%.3f' % (float(hits) / len(absent))))
+    return wrong
+
+
+def main():
+    if len(sys.argv) > 1:
+        config.redis_param['port'] = int(sys.argv[1])
+    else:
+        start_standin()
+    import bloom
+    import cache
+    from db import dbutil
+
+    dbutil.init('sqlite3', os.path.join(tempfile.mkdtemp(), 'login_filter.db'), None)
+    dbutil.update(USER_TABLE_DDL)
+    names = ['filter%d' % i for i in xrange(N)]
+    dbutil.insert_many('user', [dict(userName=u'u', loginName=n, loginPwd='', age=20) for n in names])
+    absent = ['absent%d' % i for i in xrange(N)]
+    param = config.login_filter_param
+    param.update(capacity=N, error_rate=0.01)
+    wrong = []
+
+    param['shared'] = False
+    bloom.init_login_names()
+    local = bloom.login_names
+    wrong.extend(('local ' + what, e, g) for what, e, g in check_filter(local, names, absent, 0.01))
+
+    param['shared'] = True
+    cache.redis_cache.delete(cache.login_filter_key)
+    bloom.init_login_names()
+    shared = bloom.login_names
+    if not isinstance(shared, bloom.RedisBloomFilter):
+        wrong.append(('shared filter', 'RedisBloomFilter', type(shared).__name__))
+    wrong.extend(('shared ' + what, e, g) for what, e, g in check_filter(shared, names, absent, 0.01))
+    # a second worker finds the key and reuses it, and sees what the first one adds.
+    bloom.init_login_names()
+    if bloom.login_names.count != 0:
+        wrong.append(('shared reused', 'count 0', 'count %d' % bloom.login_names.count))
+    shared.add('filter_new').result()
+    if not bloom.login_names.contains('filter_new').result():
+        wrong.append(('shared add', True, False))
+
+    for what, expected, got in wrong:
+        print '  WRONG %-26s expected %s, got %s' % (what, expected, got)
+    print 'login name filter checks: %s' % ('%d wrong' % len(wrong) if wrong else 'ok')
+
+    report('login name lookup', [
+        ('in-process', measure(lambda: local.contains('absent1').result(), 20000)),
+        ('shared', measure(lambda: shared.contains('absent1').result(), 2000)),
+    ])
+    cache.redis_cache.delete(cache.login_filter_key)
+    if wrong:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Password verifications per second, which bound logins per second, for thread and process pools of 1 to N workers.
+The IOLoop only waits on the futures, so these are the rates a worker process can sustain with its loop still free.
+python -m bench.password_hash [iterations] [logins]
+'''
+
+import sys
+import time
+import multiprocessing
+from concurrent.futures import wait
+from passwords import PasswordHasher
+
+
+def logins_per_sec(hasher, stored, n):
+    # warm the pool up, processes are started on first use.
+    wait([hasher.verify_async('secret', stored) for i in xrange(hasher.max_workers)])
+    started = time.time()
+    futures = [hasher.verify_async('secret', stored) for i in xrange(n)]
+    wait(futures)
+    assert all(f.result()[0] for f in futures)
+    return n / (time.time() - started)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    cores = multiprocessing.cpu_count()
+    stored = PasswordHasher(iterations).hash('secret')
+    started = time.time()
+    PasswordHasher(iterations).verify('secret', stored)
+    print 'pbkdf2_sha256 %d iterations: %.1f ms per hash inline, %d cores' % (
+        iterations, (time.time() - started) * 1000, cores)
+    for workers in sorted(set([1, 2, cores, cores * 2])):
+        for processes in (False, True):
+            hasher = PasswordHasher(iterations, workers, processes)
+            print '  %-8s x%-3d %8.1f logins/sec' % ('process' if processes else 'thread', workers,
+                                                   logins_per_sec(hasher, stored, n))
+            hasher._get_executor().shutdown()
+
+
+if __name__ == '__main__':
+    main()
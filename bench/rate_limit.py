@@ -0,0 +1,78 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+ratelimit.TOKEN_BUCKET: checks its decisions at given clock values (burst, refusal, retry time, refill, a refused
+dimension not charging the others), then the cost of a check. Against a redis-server it runs the Lua script itself,
+against the stand-in only its Python emulation. Exits 1 when a decision is wrong.
+python -m bench.rate_limit             # in-process stand-in
+python -m bench.rate_limit 6379        # redis-server on localhost:6379
+'''
+
+import sys
+import config
+from bench import measure, report, start_standin
+
+
+def check_decisions(client, script):
+    '''
+    Run the script at chosen clock values, return the list of (what, expected, got) that differ.
+    '''
+    a, b = 'bench_rate_a', 'bench_rate_b'
+    client.deletes([a, b])
+    wrong = []
+
+    def run(what, keys, now, limits, expected):
+        args = [now]
+        for rate, burst in limits:
+            args.extend((rate, burst))
+        got = list(client.run_script(script, keys, args))
+        if got != expected:
+            wrong.append((what, expected, got))
+
+    for i in xrange(3):
+        run('burst %d of 3' % (i + 1), [a], 1000, [(1, 3)], [1, 0, 0])
+    run('bucket empty', [a], 1000, [(1, 3)], [0, 1, 1000])
+    run('half refilled', [a], 1500, [(1, 3)], [0, 1, 500])
+    run('refilled', [a], 2000, [(1, 3)], [1, 0, 0])
+    # b is empty: a must not be charged.
+    run('b burst', [b], 2000, [(0.1, 1)], [1, 0, 0])
+    run('b empty', [a, b], 5000, [(1, 3), (0.1, 1)], [0, 2, 7000])
+    run('a not charged', [a], 5000, [(1, 3)], [1, 0, 0])
+    run('a not charged', [a], 5000, [(1, 3)], [1, 0, 0])
+    run('a not charged', [a], 5000, [(1, 3)], [1, 0, 0])
+    run('a empty again', [a], 5000, [(1, 3)], [0, 1, 1000])
+    ttl = client.raw().pttl(a)
+    if not 0 < ttl <= 3000:
+        wrong.append(('pttl of a', '1..3000', ttl))
+    client.deletes([a, b])
+    return wrong
+
+
+def main():
+    if len(sys.argv) > 1:
+        config.redis_param['port'] = int(sys.argv[1])
+    else:
+        start_standin()
+    from cache import RedisClient
+    from ratelimit import TOKEN_BUCKET
+    client = RedisClient()
+
+    wrong = check_decisions(client, TOKEN_BUCKET)
+    for what, expected, got in wrong:
+        print '  WRONG %-20s expected %s, got %s' % (what, expected, got)
+    print 'token bucket decisions: %s' % ('%d wrong' % len(wrong) if wrong else 'ok')
+
+    now = iter(xrange(10 ** 12))
+    report('token bucket check', [
+        ('1 dimension', measure(lambda: client.run_script(
+            TOKEN_BUCKET, ['bench_rate_1'], [next(now), 1000000, 1000000]), 2000)),
+        ('2 dimensions', measure(lambda: client.run_script(
+            TOKEN_BUCKET, ['bench_rate_1', 'bench_rate_2'], [next(now), 1000000, 1000000, 1000000, 1000000]), 2000)),
+    ])
+    if wrong:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
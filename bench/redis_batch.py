@@ -0,0 +1,60 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Batch cache methods against looped single key calls.
+python -m bench.redis_batch            # in-process stand-in
+python -m bench.redis_batch 6379       # redis-server on localhost:6379
+'''
+
+import sys
+import config
+from bench import measure, report, start_standin
+
+N = 200
+
+
+def main():
+    if len(sys.argv) > 1:
+        config.redis_param['port'] = int(sys.argv[1])
+    else:
+        start_standin()
+    from cache import RedisClient
+    client = RedisClient()
+    keys = ['bench_batch_%d' % i for i in xrange(N)]
+    mapping = dict((k, {'pid': i, 'loginName': k}) for i, k in enumerate(keys))
+
+    def loop_set():
+        for k, v in mapping.iteritems():
+            client.set(k, v)
+
+    def loop_get():
+        for k in keys:
+            client.get(k)
+
+    def loop_hset():
+        for k, v in mapping.iteritems():
+            client.hset('bench_hash', k, v)
+
+    def loop_hget():
+        for k in keys:
+            client.hget('bench_hash', k)
+
+    def loop_delete():
+        for k in keys:
+            client.delete(k)
+
+    report('set %d keys' % N, [('set loop', measure(loop_set, 1)),
+                               ('sets', measure(lambda: client.sets(mapping), 1))])
+    report('get %d keys' % N, [('get loop', measure(loop_get, 1)),
+                               ('gets', measure(lambda: client.gets(*keys), 1))])
+    report('hset %d fields' % N, [('hset loop', measure(loop_hset, 1)),
+                                  ('hsets', measure(lambda: client.hsets('bench_hash', mapping), 1))])
+    report('hget %d fields' % N, [('hget loop', measure(loop_hget, 1)),
+                                  ('hgets', measure(lambda: client.hgets('bench_hash', keys), 1))])
+    report('delete %d keys' % N, [('delete loop', measure(loop_delete, 1)),
+                                  ('deletes', measure(lambda: client.deletes(keys), 1))])
+
+
+if __name__ == '__main__':
+    main()
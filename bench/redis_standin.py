@@ -0,0 +1,435 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+A small in-process Redis stand-in speaking RESP over TCP, for benchmarks when no redis-server is available.
+Only the commands used by cache.py are supported: strings, hashes, bits, expiry, pub/sub, and the Lua scripts of the
+application, which are emulated in Python and recognized by the name in their first line.
+standin = RedisStandin().start()
+config.redis_param["port"] = standin.port
+'''
+
+import re
+import math
+import socket
+import hashlib
+import threading
+import time
+import SocketServer
+
+
+class _Store(object):
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.subscribers = {}  # channel -> set of handlers
+        self.scripts = {}  # sha1 -> emulation of a loaded script
+        self.lock = threading.RLock()
+
+    def alive(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+
+class _Error(Exception):
+    pass
+
+
+def _int(v):
+    try:
+        return int(v)
+    except ValueError:
+        raise _Error('ERR value is not an integer or out of range')
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        SocketServer.StreamRequestHandler.setup(self)
+        self.channels = set()
+        self.write_lock = threading.Lock()
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if line[0] != '*':
+            return line.split()
+        args = []
+        for i in xrange(int(line[1:])):
+            n = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(n + 2)[:-2])
+        return args
+
+    def _encode(self, v):
+        if v is None:
+            return '$-1\r\n'
+        if isinstance(v, bool):
+            return ':%d\r\n' % v
+        if isinstance(v, (int, long)):
+            return ':%d\r\n' % v
+        if isinstance(v, _Status):
+            return '+%s\r\n' % v
+        if isinstance(v, _Error):
+            return '-%s\r\n' % v
+        if isinstance(v, (list, tuple)):
+            return '*%d\r\n%s' % (len(v), ''.join([self._encode(x) for x in v]))
+        v = str(v)
+        return '$%d\r\n%s\r\n' % (len(v), v)
+
+    def send(self, v):
+        with self.write_lock:
+            self.wfile.write(self._encode(v))
+            self.wfile.flush()
+
+    def handle(self):
+        store = self.server.store
+        try:
+            while True:
+                args = self._read_command()
+                if args is None:
+                    break
+                if not args:
+                    continue
+                name = args[0].upper()
+                fn = getattr(self, 'cmd_' + name.lower(), None)
+                if fn is None:
+                    self.send(_Error("ERR unknown command '%s'" % name))
+                    continue
+                try:
+                    with store.lock:
+                        r = fn(store, *args[1:])
+                except _Error, e:
+                    r = e
+                except TypeError:
+                    r = _Error("ERR wrong number of arguments for '%s' command" % name)
+                if r is not _NO_REPLY:
+                    self.send(r)
+        except socket.error:
+            pass
+        finally:
+            with store.lock:
+                for ch in self.channels:
+                    store.subscribers.get(ch, set()).discard(self)
+
+    # connection
+    def cmd_ping(self, store, *args):
+        return _Status('PONG')
+
+    def cmd_select(self, store, db):
+        return _OK
+
+    def cmd_client(self, store, *args):
+        return _OK
+
+    def cmd_flushdb(self, store, *args):
+        store.data.clear()
+        store.expires.clear()
+        return _OK
+
+    # strings
+    def cmd_get(self, store, key):
+        if not store.alive(key):
+            return None
+        v = store.data[key]
+        if isinstance(v, bytearray):
+            return str(v)
+        if not isinstance(v, str):
+            raise _Error('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return v
+
+    def cmd_set(self, store, key, value, *opts):
+        store.data[key] = value
+        store.expires.pop(key, None)
+        opts = [o.upper() for o in opts]
+        for i, o in enumerate(opts):
+            if o == 'EX':
+                store.expires[key] = time.time() + _int(opts[i + 1])
+            elif o == 'PX':
+                store.expires[key] = time.time() + _int(opts[i + 1]) / 1000.0
+        return _OK
+
+    def cmd_setex(self, store, key, seconds, value):
+        return self.cmd_set(store, key, value, 'EX', seconds)
+
+    def cmd_mget(self, store, *keys):
+        return [self.cmd_get(store, k) if store.alive(k) and isinstance(store.data[k], str) else None for k in keys]
+
+    def cmd_mset(self, store, *kv):
+        for i in xrange(0, len(kv), 2):
+            self.cmd_set(store, kv[i], kv[i + 1])
+        return _OK
+
+    def cmd_incr(self, store, key):
+        return self.cmd_incrby(store, key, '1')
+
+    def cmd_incrby(self, store, key, n):
+        v = _int(store.data[key]) + _int(n) if store.alive(key) else _int(n)
+        store.data[key] = str(v)
+        return v
+
+    # keys
+    def cmd_del(self, store, *keys):
+        n = 0
+        for k in keys:
+            if store.alive(k):
+                del store.data[k]
+                store.expires.pop(k, None)
+                n += 1
+        return n
+
+    def cmd_exists(self, store, *keys):
+        return sum(1 for k in keys if store.alive(k))
+
+    def cmd_expire(self, store, key, seconds):
+        return self.cmd_pexpire(store, key, _int(seconds) * 1000)
+
+    def cmd_pexpire(self, store, key, ms):
+        if not store.alive(key):
+            return 0
+        store.expires[key] = time.time() + _int(ms) / 1000.0
+        return 1
+
+    def cmd_pttl(self, store, key):
+        if not store.alive(key):
+            return -2
+        deadline = store.expires.get(key)
+        return -1 if deadline is None else int((deadline - time.time()) * 1000)
+
+    def cmd_ttl(self, store, key):
+        r = self.cmd_pttl(store, key)
+        return r if r < 0 else r // 1000
+
+    # hashes
+    def _hash(self, store, name, create=False):
+        if not store.alive(name):
+            if not create:
+                return {}
+            store.data[name] = {}
+        h = store.data[name]
+        if not isinstance(h, dict):
+            raise _Error('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return h
+
+    def cmd_hset(self, store, name, *kv):
+        h = self._hash(store, name, True)
+        n = 0
+        for i in xrange(0, len(kv), 2):
+            n += kv[i] not in h
+            h[kv[i]] = kv[i + 1]
+        return n
+
+    def cmd_hmset(self, store, name, *kv):
+        self.cmd_hset(store, name, *kv)
+        return _OK
+
+    def cmd_hget(self, store, name, key):
+        return self._hash(store, name).get(key)
+
+    def cmd_hmget(self, store, name, *keys):
+        h = self._hash(store, name)
+        return [h.get(k) for k in keys]
+
+    def cmd_hdel(self, store, name, *keys):
+        h = self._hash(store, name)
+        n = 0
+        for k in keys:
+            if h.pop(k, None) is not None:
+                n += 1
+        if not h:
+            store.data.pop(name, None)
+        return n
+
+    # bits
+    def _bits(self, store, key, create=False):
+        # bitmaps are kept as bytearray, changed in place; GET returns them as strings.
+        if not store.alive(key):
+            if not create:
+                return bytearray()
+            store.data[key] = bytearray()
+        v = store.data[key]
+        if isinstance(v, str):
+            v = store.data[key] = bytearray(v)
+        return v
+
+    def cmd_setbit(self, store, key, offset, value):
+        offset = _int(offset)
+        s = self._bits(store, key, True)
+        byte, bit = offset >> 3, 7 - (offset & 7)
+        if len(s) <= byte:
+            s.extend('\x00' * (byte + 1 - len(s)))
+        old = (s[byte] >> bit) & 1
+        if _int(value):
+            s[byte] |= 1 << bit
+        else:
+            s[byte] &= ~(1 << bit)
+        return old
+
+    def cmd_getbit(self, store, key, offset):
+        offset = _int(offset)
+        s = self._bits(store, key)
+        byte, bit = offset >> 3, 7 - (offset & 7)
+        if len(s) <= byte:
+            return 0
+        return (s[byte] >> bit) & 1
+
+    # scripts
+    def cmd_evalsha(self, store, sha, numkeys, *rest):
+        fn = store.scripts.get(sha.lower())
+        if fn is None:
+            raise _Error('NOSCRIPT No matching script. Please use EVAL.')
+        n = _int(numkeys)
+        return fn(self, store, rest[:n], rest[n:])
+
+    def cmd_eval(self, store, source, numkeys, *rest):
+        return self.cmd_evalsha(store, _load_script(store, source), numkeys, *rest)
+
+    def cmd_script(self, store, sub, *args):
+        sub = sub.upper()
+        if sub == 'LOAD':
+            return _load_script(store, args[0])
+        if sub == 'EXISTS':
+            return [int(sha.lower() in store.scripts) for sha in args]
+        return _OK
+
+    # pub/sub
+    def cmd_publish(self, store, channel, message):
+        handlers = list(store.subscribers.get(channel, ()))
+        for h in handlers:
+            try:
+                h.send(['message', channel, message])
+            except socket.error:
+                pass
+        return len(handlers)
+
+    def cmd_subscribe(self, store, *channels):
+        for ch in channels:
+            store.subscribers.setdefault(ch, set()).add(self)
+            self.channels.add(ch)
+            self.send(['subscribe', ch, len(self.channels)])
+        return _NO_REPLY
+
+    def cmd_unsubscribe(self, store, *channels):
+        for ch in channels or list(self.channels):
+            store.subscribers.get(ch, set()).discard(self)
+            self.channels.discard(ch)
+            self.send(['unsubscribe', ch, len(self.channels)])
+        return _NO_REPLY
+
+
+def _token_bucket(handler, store, keys, args):
+    # ratelimit.TOKEN_BUCKET
+    now = float(args[0])
+    tokens = []
+    for i, k in enumerate(keys):
+        rate, burst = float(args[i * 2 + 1]), float(args[i * 2 + 2])
+        h = handler._hash(store, k)
+        if 't' not in h:
+            t = burst
+        else:
+            t = min(burst, float(h['t']) + max(0, now - float(h['ts'])) * rate / 1000)
+        if t < 1:
+            return [0, i + 1, int(math.ceil((1 - t) * 1000 / rate))]
+        tokens.append(t)
+    for i, k in enumerate(keys):
+        rate, burst = float(args[i * 2 + 1]), float(args[i * 2 + 2])
+        handler.cmd_hset(store, k, 't', repr(tokens[i] - 1), 'ts', args[0])
+        handler.cmd_pexpire(store, k, int(math.ceil(burst * 1000 / rate)))
+    return [1, 0, 0]
+
+
+# scripts the stand-in can run, by the name in their first line: "-- name: token_bucket".
+_emulations = {'token_bucket': _token_bucket}
+_RE_SCRIPT_NAME = re.compile(r'^\s*--\s*name:\s*(\w+)')
+
+
+def _load_script(store, source):
+    m = _RE_SCRIPT_NAME.match(source)
+    if m is None or m.group(1) not in _emulations:
+        raise _Error('ERR the stand-in can not run this script')
+    sha = hashlib.sha1(source).hexdigest()
+    store.scripts[sha] = _emulations[m.group(1)]
+    return sha
+
+
+class _Status(str):
+    pass
+
+
+_OK = _Status('OK')
+_NO_REPLY = object()
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def server_activate(self):
+        SocketServer.TCPServer.server_activate(self)
+        self.connections = {}  # thread -> socket of each open connection
+        self.connections_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        t = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+        t.daemon = True
+        with self.connections_lock:
+            self.connections[t] = request
+        t.start()
+
+    def process_request_thread(self, request, client_address):
+        try:
+            SocketServer.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self.connections_lock:
+                self.connections.pop(threading.current_thread(), None)
+
+    def close_connections(self):
+        '''
+        Close the open connections and wait for their threads, so that none is left running at interpreter shutdown.
+        '''
+        with self.connections_lock:
+            connections = self.connections.items()
+        for t, request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        for t, request in connections:
+            t.join(1)
+
+    def handle_error(self, request, client_address):
+        # clients going away.
+        pass
+
+
+class RedisStandin(object):
+    '''
+    Run the stand-in on host:port (port 0 picks a free one) in a daemon thread.
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = _Server((host, port), _Handler)
+        self._server.store = _Store()
+        self.host, self.port = self._server.server_address
+
+    def start(self):
+        t = threading.Thread(target=self._server.serve_forever, name='redis-standin')
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._server.close_connections()
+
+
+if __name__ == '__main__':
+    import sys
+    standin = RedisStandin(port=int(sys.argv[1]) if len(sys.argv) > 1 else 6379).start()
+    print 'redis stand-in listening on %s:%s' % (standin.host, standin.port)
+    while True:
+        time.sleep(3600)
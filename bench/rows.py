@@ -0,0 +1,44 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Memory and build time of 100k result rows, utils.Dict against compact rows.Row.
+python -m bench.rows
+'''
+
+import sys
+from bench import measure, report
+from utils import Dict
+from db.rows import row_class
+
+NAMES = ('pid', 'userName', 'loginName', 'loginPwd', 'age')
+N = 100000
+
+
+def _fetchall():
+    return [(i, u'user%d' % i, u'login%d' % i, u'pwd', 20 + i % 50) for i in xrange(N)]
+
+
+def _row_bytes(rows):
+    # values are shared by both row types, only count what the row itself adds.
+    return sum(sys.getsizeof(r) for r in rows)
+
+
+def main():
+    values = _fetchall()
+    make = row_class(NAMES)
+    dict_rows = [Dict(NAMES, x) for x in values]
+    compact_rows = map(make, values)
+    report('build %d rows' % N, [
+        ('Dict', measure(lambda: [Dict(NAMES, x) for x in values], 1, 3)),
+        ('Row', measure(lambda: map(row_class(NAMES), values), 1, 3)),
+    ])
+    dict_bytes, compact_bytes = _row_bytes(dict_rows), _row_bytes(compact_rows)
+    print 'memory of %d rows, values excluded' % N
+    print '  %-40s %10.1f MB' % ('Dict', dict_bytes / 1048576.0)
+    print '  %-40s %10.1f MB  (values tuple kept from the cursor: %.1f MB)' % (
+        'Row', compact_bytes / 1048576.0, sum(sys.getsizeof(x) for x in values) / 1048576.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Compiled statement cache against building the SQL on every call, with the MySQL placeholder.
+python -m bench.sql_cache
+'''
+
+from bench import measure, report
+from db import dbutil
+
+USER_COLS = ('loginName', 'loginPwd', 'userName', 'age')
+
+
+def _legacy_compile(sql):
+    return sql.replace('?', '%s')
+
+
+def _legacy_insert_sql(table, cols):
+    return 'insert into %s (%s) values (%s)' % (table, ','.join(cols), ','.join(['%s' for i in range(len(cols))]))
+
+
+def _legacy_update_kw_sql(table, cols, where):
+    sqls = ['update', table, 'set', ', '.join(['%s=?' % k for k in cols]), 'where', where]
+    return _legacy_compile(' '.join(sqls))
+
+
+def main():
+    # only the placeholder matters here, no connection is ever opened.
+    dbutil.init_connector(lambda: None, '%s', max_size=0)
+    report('insert statement', [
+        ('build', measure(lambda: _legacy_insert_sql('user', USER_COLS), 100000)),
+        ('cached', measure(lambda: dbutil._insert_sql('user', USER_COLS), 100000)),
+    ])
+    report('update_kw statement', [
+        ('build', measure(lambda: _legacy_update_kw_sql('user', USER_COLS, 'pid=?'), 100000)),
+        ('cached', measure(lambda: dbutil._update_kw_sql('user', USER_COLS, 'pid=?'), 100000)),
+    ])
+    print dbutil.statement_cache_stats()
+
+
+if __name__ == '__main__':
+    main()
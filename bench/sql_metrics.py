@@ -0,0 +1,45 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Cost of recording one statement: the former INFO log line per statement against metrics.Registry.query.
+python -m bench.sql_metrics
+'''
+
+import time
+from bench import measure, report
+from config import logger
+import metrics
+
+SQL = 'select pid, userName, loginName, loginPwd, age from user where loginName=?'
+
+
+def _log_each(start, sql, rows):
+    # dbutil._profiling before the registry: one formatted log line per statement.
+    t = time.time() - start
+    sql = '%s [ROWS] %s' % (sql, rows)
+    if t > 0.1:
+        logger.warning('[PROFILING] [DB] %s: %s' % (t, sql))
+    else:
+        logger.info('[PROFILING] [DB] %s: %s' % (t, sql))
+
+
+def main():
+    registry = metrics.Registry(slow_threshold=0.1, sample_rate=0.001)
+    quiet = metrics.Registry(slow_threshold=0.1, sample_rate=0)
+    start = time.time()
+    report('record one statement', [
+        ('log line per statement', measure(lambda: _log_each(start, SQL, 1), 10000, 3)),
+        ('registry, 0.1% sampled log', measure(lambda: registry.query(SQL, 0.001, 1), 100000, 3)),
+        ('registry, no log', measure(lambda: quiet.query(SQL, 0.001, 1), 100000, 3)),
+    ])
+    report('fingerprint', [
+        ('uncached', measure(lambda: metrics.fingerprint(SQL), 10000, 3)),
+        ('cached', measure(lambda: registry._fingerprint(SQL), 100000, 3)),
+    ])
+    print 'p50 %.6f p95 %.6f p99 %.6f' % tuple(quiet.query_stats()[metrics.fingerprint(SQL)][k]
+                                               for k in ('p50', 'p95', 'p99'))
+
+
+if __name__ == '__main__':
+    main()
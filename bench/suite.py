@@ -0,0 +1,194 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Microbenchmarks of the hot paths, offline: dbutil on sqlite3, RedisClient on the stand-in, captcha images, result
+rows and the utils date helpers. Every run of a case lasts at least --min-time seconds, however short the case, and
+the best of --repeat runs counts. The runs of all cases take turns, so that a slow spell of the machine spoils one run
+of a few cases rather than every run of one case. Results (us per call) can be saved as a JSON baseline, and a later
+run compared to it, failing when a case got slower than the tolerance allows. Baselines only compare on the same
+machine.
+python -m bench.suite                                  # run and print
+python -m bench.suite --save baseline.json             # run and save
+python -m bench.suite --compare baseline.json          # run, exit 1 on regressions above 20%
+python -m bench.suite --compare baseline.json --tolerance 0.1 --only 'db\.'
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from bench import USER_TABLE_DDL, measure, calibrate, start_standin
+
+ROW_NAMES = ('pid', 'userName', 'loginName', 'loginPwd', 'age')
+USERS = 1000
+
+
+def _init_db(tmp):
+    from db import dbutil
+    # one pooled connection without fsync per commit: measures dbutil and sqlite, not the disk.
+    dbutil.init('sqlite3', os.path.join(tmp, 'suite.db'), None, pool_min_size=1, pool_max_size=1)
+    dbutil.update('pragma synchronous=off')
+    dbutil.update(USER_TABLE_DDL)
+    dbutil.insert_many('user', [dict(userName=u'user%d' % i, loginName='login%d' % i, loginPwd='pwd', age=20 + i % 50)
+                                for i in xrange(USERS)])
+    return dbutil
+
+
+def _db_cases(dbutil):
+    inserted = iter(xrange(USERS, 10 ** 9))
+    pids = iter(xrange(10 ** 9))
+    return [
+        ('db.select_one', lambda: dbutil.select_one('select * from user where pid=?', next(pids) % USERS + 1)),
+        ('db.select 20 rows', lambda: dbutil.select('select * from user where pid>? limit 20',
+                                                    next(pids) % (USERS - 20))),
+        ('db.insert', lambda: dbutil.insert('user', userName=u'new', loginName='login%d' % next(inserted),
+                                            loginPwd='pwd', age=30)),
+        ('db.update_kw', lambda: dbutil.update_kw('user', 'pid=?', next(pids) % USERS + 1, age=31)),
+    ]
+
+
+REDIS_VALUE = {'pid': 1, 'userName': u'user1', 'loginName': 'login1', 'age': 21}
+REDIS_KEYS = ['bench_suite_%d' % i for i in xrange(20)]
+
+
+def _init_redis(tmp):
+    start_standin()
+    from cache import RedisClient
+    client = RedisClient()
+    client.sets(dict((k, REDIS_VALUE) for k in REDIS_KEYS))
+    return client
+
+
+def _redis_cases(client):
+    return [
+        ('redis.set', lambda: client.set('bench_suite_0', REDIS_VALUE)),
+        ('redis.get', lambda: client.get('bench_suite_0')),
+        ('redis.gets 20 keys', lambda: client.gets(*REDIS_KEYS)),
+    ]
+
+
+def _init_captcha(tmp):
+    import captcha
+    return captcha
+
+
+def _captcha_cases(captcha):
+    return [
+        ('captcha.random_code', lambda: captcha.random_code()),
+        ('captcha.generate', lambda: captcha.generate()),
+    ]
+
+
+def _init_rows(tmp):
+    from db.rows import row_class
+    return row_class(ROW_NAMES)
+
+
+def _row_cases(make):
+    from utils import Dict
+    values = (1, u'user1', u'login1', u'pwd', 21)
+    return [
+        ('rows.Dict', lambda: Dict(ROW_NAMES, values)),
+        ('rows.Row', lambda: make(values)),
+    ]
+
+
+def _utils_cases(ignored):
+    from utils import compute_age, compute_star
+    return [
+        ('utils.compute_age', lambda: compute_age('1990-06-15')),
+        ('utils.compute_star', lambda: compute_star('1990-06-15')),
+    ]
+
+
+# (setup(tmp dir) returning what the cases use, cases(what setup returned) returning [(name, func)]). cases only
+# builds the funcs, so that cases(None) gives the names without the setup.
+GROUPS = [
+    (_init_db, _db_cases),
+    (_init_redis, _redis_cases),
+    (_init_captcha, _captcha_cases),
+    (_init_rows, _row_cases),
+    (lambda tmp: None, _utils_cases),
+]
+
+
+def run(only=None, repeat=5, min_time=0.2):
+    '''
+    Return {case: best us per call} of the cases whose name matches the regex only. Each run of a case lasts at least
+    min_time seconds, groups without a matching case are not set up.
+    '''
+    tmp = tempfile.mkdtemp()
+    try:
+        selected = []
+        for setup, cases in GROUPS:
+            names = [name for name, func in cases(None) if not only or re.search(only, name)]
+            if not names:
+                continue
+            for name, func in cases(setup(tmp)):
+                if name in names:
+                    selected.append((name, func, calibrate(func, min_time)))
+        results = {}
+        for i in xrange(repeat):
+            for name, func, number in selected:
+                us = measure(func, number, 1)
+                results[name] = min(results.get(name, us), us)
+        for name, func, number in selected:
+            print '  %-30s %12.3f us' % (name, results[name])
+        return results
+    finally:
+        shutil.rmtree(tmp, True)
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Print every case against the baseline, return the names of the cases slower than baseline * (1 + tolerance).
+    '''
+    regressions = []
+    print '%-30s %12s %12s %8s' % ('case', 'baseline us', 'now us', 'ratio')
+    for name in sorted(results):
+        old = baseline.get(name)
+        if old is None:
+            print '%-30s %12s %12.3f %8s' % (name, '-', results[name], 'new')
+            continue
+        ratio = results[name] / old if old else 0.0
+        slower = ratio > 1 + tolerance
+        if slower:
+            regressions.append(name)
+        print '%-30s %12.3f %12.3f %7.2fx%s' % (name, old, results[name], ratio, '  REGRESSION' if slower else '')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hot path microbenchmarks')
+    parser.add_argument('--save', metavar='FILE', help='save the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare with a JSON baseline, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, 0.2 = 20%% (default)')
+    parser.add_argument('--only', metavar='REGEX', help='only run the cases matching REGEX')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case, the best one counts (default 5)')
+    parser.add_argument('--min-time', type=float, default=0.2, help='least seconds of each run (default 0.2)')
+    args = parser.parse_args()
+
+    results = run(args.only, args.repeat, args.min_time)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                       'machine': platform.platform(), 'results': results}, f, indent=2, sort_keys=True)
+        print 'saved %d cases to %s' % (len(results), args.save)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print '%d regression(s) above %d%%: %s' % (len(regressions), args.tolerance * 100, ', '.join(regressions))
+            sys.exit(1)
+        print 'no regression above %d%%' % (args.tolerance * 100)
+
+
+if __name__ == '__main__':
+    main()
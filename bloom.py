@@ -0,0 +1,148 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Bloom filters answering "may this value exist?" without a query. A miss is definite, a hit may be false (about
+error_rate of the time once capacity values are in). Used to skip the existence select of Register for login names
+that certainly do not exist yet; the unique key on user.loginName stays the real guarantee, so a filter that lags
+behind the table (built while users register, or a name added by another worker) only costs a duplicate insert
+that fails, never a duplicate row.
+'''
+
+import math
+import struct
+import hashlib
+from concurrent.futures import Future
+from config import logger, login_filter_param
+from utils import utf8, done_future
+from db import dbutil
+import cache
+
+
+class BloomFilter(object):
+    '''
+    In-process Bloom filter over a bytearray, bits laid out like a Redis bitmap (most significant bit first).
+    Args:
+      capacity: number of values the filter is sized for.
+      error_rate: false positive rate at capacity.
+
+    f = BloomFilter(100000, 0.01)
+    f.add('bob')
+    'bob' in f
+    True
+    '''
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(float(self.size) / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def offsets(self, value):
+        '''
+        Return the bit offsets of value, by double hashing of one md5 digest.
+        '''
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(utf8(value)).digest())
+        return [(h1 + i * h2) % self.size for i in xrange(self.hashes)]
+
+    def add(self, value):
+        '''
+        Add value. Returns a Future, like RedisBloomFilter.add.
+        '''
+        for o in self.offsets(value):
+            self._bits[o >> 3] |= 0x80 >> (o & 7)
+        self.count += 1
+        return done_future(True)
+
+    def add_many(self, values):
+        for v in values:
+            self.add(v)
+
+    def __contains__(self, value):
+        bits = self._bits
+        for o in self.offsets(value):
+            if not bits[o >> 3] & (0x80 >> (o & 7)):
+                return False
+        return True
+
+    def contains(self, value):
+        '''
+        Return a Future of whether value may exist, like RedisBloomFilter.contains.
+        '''
+        return done_future(value in self)
+
+
+class RedisBloomFilter(BloomFilter):
+    '''
+    Bloom filter kept in the Redis bitmap key and shared by all workers, through an AsyncRedisClient. Every lookup
+    costs one pipelined round trip of GETBITs. On Redis errors values are reported as possibly existing, so callers
+    fall back to querying.
+    '''
+
+    def __init__(self, client, key, capacity=1000000, error_rate=0.01):
+        BloomFilter.__init__(self, capacity, error_rate)
+        self._bits = None
+        self._client = client
+        self.key = key
+
+    def add(self, value):
+        self.count += 1
+        return self._client.setbits(self.key, self.offsets(value))
+
+    def add_many(self, values, batch_size=1000):
+        '''
+        Add values, batch_size values per round trip, blocking until done.
+        '''
+        offsets = []
+        for v in values:
+            offsets.extend(self.offsets(v))
+            self.count += 1
+            if len(offsets) >= batch_size * self.hashes:
+                self._client.setbits(self.key, offsets).result()
+                offsets = []
+        if offsets:
+            self._client.setbits(self.key, offsets).result()
+
+    def __contains__(self, value):
+        return self.contains(value).result()
+
+    def contains(self, value):
+        f = Future()
+
+        def done(r):
+            try:
+                bits = r.result()
+            except Exception:
+                bits = -1
+            f.set_result(bits == -1 or all(bits))
+
+        self._client.getbits(self.key, self.offsets(value)).add_done_callback(done)
+        return f
+
+
+login_names = None  # 已有登录名的过滤器, init_login_names() 之前为None
+
+
+def init_login_names():
+    '''
+    Build the login name filter of config.login_filter_param, streaming the names from the user table. A shared
+    filter is only built by the first worker that finds its Redis key missing.
+    '''
+    global login_names
+    if login_filter_param is None:
+        login_names = None
+        return
+    param = dict(login_filter_param)
+    shared = param.pop('shared', False)
+    if shared:
+        f = RedisBloomFilter(cache.async_redis_cache, cache.login_filter_key, **param)
+        if cache.redis_cache.exists(cache.login_filter_key) is not False:
+            login_names = f
+            return
+    else:
+        f = BloomFilter(**param)
+    f.add_many(row.loginName for row in dbutil.select_iter('select loginName from user'))
+    logger.info('login name filter built: %d names, %d bits, %d hashes', f.count, f.size, f.hashes)
+    login_names = f
@@ -5,16 +5,21 @@ __author__ = 'chenghao'
 A simple cache interface.
 '''
 
-from config import logger, redis_param
+import time
+import uuid
+import threading
+from config import logger, redis_param, redis_local_cache_param, redis_serializer_param, redis_async_param
+from utils import Dict, LRUCache
+from serializer import Serializer
+import metrics
 import redis
 from redis.exceptions import RedisError
-
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
+from concurrent.futures import ThreadPoolExecutor
 
 user_session_prefix = "websetup_user"  # 用户session前缀
+session_prefix = "websetup_session"  # 会话前缀
+rate_limit_prefix = "websetup_rate"  # 限流计数前缀
+login_filter_key = "websetup_login_names"  # 登录名布隆过滤器
 retri_pwd_prefix = "websetup_retripwd"  # 用户找回密码前缀
 ver_code_prefix = "websetup_ver_code"  # 用户验证码前缀
 
@@ -24,56 +29,396 @@ quarter = one_hour * 24 * 91  # 一季度
 half_year = quarter * 2  # 半年
 
 
-def _safe_pickle_loads(r):
-    if r is None:
-        return None
-    try:
-        return pickle.loads(r)
-    except pickle.UnpicklingError:
-        pass
-    return None
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.payload = None
+        self.error = None
+        self.stale = False
+
+
+class LocalCache(object):
+    '''
+    Optional in-process first tier of RedisClient: a bounded LRU of raw payloads with per-key TTL and a memory cap.
+    Concurrent misses on one key share a single Redis fetch. Hash fields are cached under (name, field), and indexed
+    by name so that deleting a hash drops its fields without scanning the tier.
+    Args:
+      max_items: most payloads kept.
+      max_bytes: most payload bytes kept.
+      ttl: longest seconds a payload is kept, never longer than the Redis TTL of its key.
+      channel: Redis pub/sub channel used to send our invalidations to, and receive them from, other workers.
+    '''
+
+    def __init__(self, max_items=10000, max_bytes=32 * 1024 * 1024, ttl=5, channel=None):
+        self.ttl = ttl
+        self.channel = channel
+        self._origin = uuid.uuid4().hex
+        self._cache = LRUCache(max_items, max_bytes, self._unindex)
+        self._fields = {}  # hash name -> set of its cached fields
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._listening = False
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self._cache.delete(key)
+            self._unindex(key)
+            return None
+        return entry[1]
+
+    def put(self, key, payload, ttl=None):
+        '''
+        Keep payload for min(ttl, self.ttl) seconds, ttl being the Redis TTL of the key or None if it has none.
+        '''
+        if ttl is not None:
+            ttl = min(ttl, self.ttl)
+        else:
+            ttl = self.ttl
+        if payload is None or ttl <= 0:
+            return
+        if isinstance(key, tuple):
+            self._fields.setdefault(key[0], set()).add(key[1])
+        self._cache.set(key, (time.time() + ttl, payload), len(payload))
+
+    def _unindex(self, key):
+        if isinstance(key, tuple):
+            fields = self._fields.get(key[0])
+            if fields is not None:
+                fields.discard(key[1])
+                if not fields:
+                    self._fields.pop(key[0], None)
+
+    def load(self, key, fetch):
+        '''
+        Return the payload of key from this tier, or from fetch() returning (payload, ttl). Concurrent misses on the
+        same key wait for the first one instead of fetching again.
+        '''
+        payload = self.get(key)
+        if payload is not None:
+            self.hits += 1
+            return payload
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            self.shared += 1
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.payload
+        self.misses += 1
+        try:
+            call.payload, ttl = fetch()
+            # a write during the fetch invalidated the key, the payload may already be old.
+            if not call.stale:
+                self.put(key, call.payload, ttl)
+            return call.payload
+        except Exception, e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def invalidate(self, key):
+        self._cache.delete(key)
+        self._unindex(key)
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.stale = True
+        self.invalidations += 1
+
+    def invalidate_hash(self, name):
+        '''
+        Invalidate every cached field of hash name.
+        '''
+        fields = self._fields.pop(name, None)
+        if fields:
+            for f in list(fields):
+                self.invalidate((name, f))
+
+    def clear(self):
+        self._cache.clear()
+        self._fields = {}
+
+    def after_fork(self):
+        '''
+        Forget the state inherited from the parent process: its payloads, its locks and its listener thread, which
+        do not survive a fork. Takes a new origin, so that workers forked from one parent see each other's messages.
+        '''
+        self._origin = uuid.uuid4().hex
+        self._cache = LRUCache(self._cache.max_size, self._cache.max_bytes, self._unindex)
+        self._fields = {}
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._listening = False
+
+    def message(self, key, deleted=False):
+        '''
+        Return the invalidation message of key, deleted telling that a key was deleted, which drops its hash fields too.
+        '''
+        if isinstance(key, tuple):
+            key = '\x00'.join(key)
+        return '%s\x01%s\x01%s' % (self._origin, 'd' if deleted else 's', key)
+
+    def _apply(self, message):
+        origin, op, key = message.split('\x01', 2)
+        if origin == self._origin:
+            return
+        if '\x00' in key:
+            self.invalidate(tuple(key.split('\x00', 1)))
+        else:
+            self.invalidate(key)
+            if op == 'd':
+                self.invalidate_hash(key)
+
+    def listen(self, client):
+        '''
+        Apply the invalidations other workers publish on self.channel, in a daemon thread. Only the first call of
+        clients sharing this tier starts one.
+        '''
+        with self._lock:
+            if self._listening:
+                return
+            self._listening = True
+        t = threading.Thread(target=self._listen, args=(client,), name='local-cache-invalidation')
+        t.daemon = True
+        t.start()
+
+    def _listen(self, client):
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # messages sent while we were not subscribed are lost, start over.
+                self.clear()
+                for msg in pubsub.listen():
+                    if msg['type'] == 'message':
+                        self._apply(msg['data'])
+            except RedisError, e:
+                logger.warning('订阅缓存失效消息失败: %s', e)
+                self.clear()
+                time.sleep(1)
+
+    def stats(self):
+        return Dict(items=len(self._cache), bytes=self._cache.bytes, hits=self.hits, misses=self.misses,
+                    shared=self.shared, evictions=self._cache.evictions, invalidations=self.invalidations,
+                    hit_ratio=float(self.hits) / (self.hits + self.misses) if self.hits + self.misses else 0.0)
+
+
+_SKIP = object()
+
+
+class Pipeline(object):
+    '''
+    Queue cache commands and send them batch_size at a time, in one round trip per batch. Use RedisClient.pipeline():
+    with redis_cache.pipeline() as p:
+        p.set(key1, 'Key1')
+        p.hset(name, key2, 'Key2')
+        p.get(key1)
+    p.results
+    [None, None, 'Key1']
+
+    results holds one item per queued command: the decoded value for get / hget, the Redis reply otherwise, and -1
+    for the commands of a batch that failed. Errors are logged like the single key methods do.
+    '''
+
+    def __init__(self, client, batch_size=100):
+        self._client = client
+        self._local = client._local
+        self._serializer = client._serializer
+        self.batch_size = batch_size
+        self.results = []
+        self._pipe = client._client.pipeline(transaction=False)
+        self._decoders = []
+        self._local_keys = []
+        self._size = 0
+
+    def _queue(self, decoder, local_key=None, deleted=False):
+        self._decoders.append(decoder)
+        if local_key is not None and self._local is not None:
+            self._local_keys.append((local_key, deleted))
+            if self._local.channel:
+                self._pipe.publish(self._local.channel, self._local.message(local_key, deleted))
+                self._decoders.append(_SKIP)
+        self._size += 1
+        if self._size >= self.batch_size:
+            self.flush()
+        return self
+
+    def set(self, key, value, expires=half_hour):
+        self._pipe.set(key, self._serializer.dumps(value), ex=expires)
+        return self._queue(None, key)
+
+    def hset(self, name, key, value):
+        self._pipe.hset(name, key, self._serializer.dumps(value))
+        return self._queue(None, (name, key))
+
+    def get(self, key):
+        self._pipe.get(key)
+        return self._queue(self._serializer.loads)
+
+    def hget(self, name, key):
+        self._pipe.hget(name, key)
+        return self._queue(self._serializer.loads)
+
+    def delete(self, key):
+        self._pipe.delete(key)
+        return self._queue(None, key, True)
+
+    def hdel(self, name, key):
+        self._pipe.hdel(name, key)
+        return self._queue(None, (name, key))
+
+    def expire(self, key, seconds):
+        self._pipe.expire(key, seconds)
+        return self._queue(None)
+
+    def flush(self):
+        '''
+        Send the queued commands now.
+        '''
+        if not self._decoders:
+            return
+        decoders, local_keys = self._decoders, self._local_keys
+        self._decoders, self._local_keys, self._size = [], [], 0
+        logger.debug('pipeline cache: commands = %s', len(decoders))
+        try:
+            replies = self._pipe.execute()
+            for decode, r in zip(decoders, replies):
+                if decode is not _SKIP:
+                    self.results.append(r if decode is None else decode(r))
+        except RedisError, e:
+            logger.error("pipeline cache 失败: %s", e, exc_info=True)
+            self._pipe.reset()
+            self.results.extend([-1 for d in decoders if d is not _SKIP])
+        finally:
+            for k, deleted in local_keys:
+                self._local.invalidate(k)
+                if deleted:
+                    self._local.invalidate_hash(k)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        if exctype is None:
+            self.flush()
+        else:
+            self._pipe.reset()
+
+
+def _ttl(pttl):
+    # PTTL is -1 for a key without expiry and -2 for a missing key.
+    return pttl / 1000.0 if pttl >= 0 else None
 
 
 class RedisClient(object):
-    def __init__(self):
+    def __init__(self, local_cache=None, serializer=None, max_connections=150, socket_timeout=None):
+        '''
+        Args:
+          local_cache: optional LocalCache read before Redis by get, hget and gets.
+          serializer: Serializer of the cached values, default to Serializer().
+          max_connections: size of the connection pool.
+          socket_timeout: seconds a command may take before it fails, default to no limit.
+        '''
         self._pool = redis.ConnectionPool(host=redis_param["host"], port=redis_param["port"], db=0,
-                                          max_connections=150)
+                                          max_connections=max_connections, socket_timeout=socket_timeout,
+                                          socket_connect_timeout=socket_timeout)
         self._client = redis.Redis(connection_pool=self._pool)
+        self._local = local_cache
+        self._serializer = Serializer() if serializer is None else serializer
+        self._scripts = {}
+        if local_cache is not None and local_cache.channel:
+            local_cache.listen(self._client)
+
+    def _write(self, local_key, command, deleted=False):
+        '''
+        Run command(client). With the local tier, invalidate local_key afterwards (and its hash fields if deleted),
+        and publish the invalidation to other workers in the same round trip.
+        '''
+        if self._local is None:
+            command(self._client)
+            return
+        if self._local.channel:
+            pipe = self._client.pipeline(transaction=False)
+            command(pipe)
+            pipe.publish(self._local.channel, self._local.message(local_key, deleted))
+            pipe.execute()
+        else:
+            command(self._client)
+        self._local.invalidate(local_key)
+        if deleted:
+            self._local.invalidate_hash(local_key)
+
+    def _fetch(self, read, ttl_key):
+        '''
+        Run read(pipe) and the PTTL of ttl_key in one round trip, return (payload, ttl) for the local tier.
+        '''
+        pipe = self._client.pipeline(transaction=False)
+        read(pipe)
+        pipe.pttl(ttl_key)
+        payload, pttl = pipe.execute()
+        return payload, _ttl(pttl)
 
     def set(self, key, value, expires=half_hour):
-        logger.debug('set cache: key = %s' % key)
+        '''
+        Set key to value for expires seconds, return -1 on error.
+        '''
+        logger.debug('set cache: key = %s', key)
         try:
-            self._client.set(key, pickle.dumps(value), ex=expires)
+            payload = self._serializer.dumps(value)
+            self._write(key, lambda c: c.set(key, payload, ex=expires))
+            if self._local is not None:
+                self._local.put(key, payload, expires)
         except RedisError, e:
-            logger.error("set cache 失败: " + str(e), exc_info=True)
+            logger.error("set cache 失败: %s", e, exc_info=True)
+            return -1
 
     def hset(self, name, key, value):
-        logger.debug('hset cache: name = %s, key = %s' % (name, key))
+        logger.debug('hset cache: name = %s, key = %s', name, key)
         try:
-            self._client.hset(name, key, pickle.dumps(value))
+            self._write((name, key), lambda c: c.hset(name, key, self._serializer.dumps(value)))
         except RedisError, e:
-            logger.error("hset cache 失败: " + str(e), exc_info=True)
+            logger.error("hset cache 失败: %s", e, exc_info=True)
 
     def get(self, key, default=None):
-        logger.debug('get cache: key = %s' % key)
+        logger.debug('get cache: key = %s', key)
         try:
-            r = self._client.get(key)
+            if self._local is None:
+                r = self._client.get(key)
+            else:
+                r = self._local.load(key, lambda: self._fetch(lambda p: p.get(key), key))
             if r is None:
                 return default
-            return _safe_pickle_loads(r)
+            return self._serializer.loads(r)
         except RedisError, e:
-            logger.error("get cache 失败: " + str(e), exc_info=True)
+            logger.error("get cache 失败: %s", e, exc_info=True)
             return -1
 
     def hget(self, name, key, default=None):
-        logger.debug('hget cache: name = %s, key = %s' % (name, key))
+        logger.debug('hget cache: name = %s, key = %s', name, key)
         try:
-            r = self._client.hget(name, key)
+            if self._local is None:
+                r = self._client.hget(name, key)
+            else:
+                r = self._local.load((name, key), lambda: self._fetch(lambda p: p.hget(name, key), name))
             if r is None:
                 return default
-            return _safe_pickle_loads(r)
+            return self._serializer.loads(r)
         except RedisError, e:
-            logger.error("hget cache 失败: " + str(e), exc_info=True)
+            logger.error("hget cache 失败: %s", e, exc_info=True)
             return -1
 
     def gets(self, *keys):
@@ -92,28 +437,289 @@ class RedisClient(object):
         c.gets(key1, key2, key3)
         ['Key1', None, 'Key3']
         '''
-        logger.debug('gets cache: keys = %s' % keys)
+        logger.debug('gets cache: keys = %s', keys)
         try:
-            return map(_safe_pickle_loads, self._client.mget(keys))
+            if self._local is None:
+                return map(self._serializer.loads, self._client.mget(keys))
+            return map(self._serializer.loads, self._local_gets(keys))
         except RedisError, e:
-            logger.error("gets cache 失败: " + str(e), exc_info=True)
+            logger.error("gets cache 失败: %s", e, exc_info=True)
             return -1
 
+    def _local_gets(self, keys):
+        payloads = [self._local.get(k) for k in keys]
+        missing = [k for k, p in zip(keys, payloads) if p is None]
+        self._local.hits += len(keys) - len(missing)
+        if not missing:
+            return payloads
+        self._local.misses += len(missing)
+        pipe = self._client.pipeline(transaction=False)
+        pipe.mget(missing)
+        for k in missing:
+            pipe.pttl(k)
+        r = pipe.execute()
+        fetched = dict(zip(missing, r[0]))
+        for k, pttl in zip(missing, r[1:]):
+            self._local.put(k, fetched[k], _ttl(pttl))
+        return [fetched[k] if p is None else p for k, p in zip(keys, payloads)]
+
     def delete(self, key):
-        logger.debug('delete cache: key = %s' % key)
+        logger.debug('delete cache: key = %s', key)
         try:
-            self._client.delete(key)
+            self._write(key, lambda c: c.delete(key), True)
         except RedisError, e:
-            logger.error("delete cache 失败: " + str(e), exc_info=True)
+            logger.error("delete cache 失败: %s", e, exc_info=True)
 
     def hdel(self, name, key):
-        logger.debug('hdel cache: name = %s, key = %s' % (name, key))
+        logger.debug('hdel cache: name = %s, key = %s', name, key)
         try:
-            self._client.hdel(name, key)
+            self._write((name, key), lambda c: c.hdel(name, key))
         except RedisError, e:
-            logger.error("hdel cache 失败: " + str(e), exc_info=True)
+            logger.error("hdel cache 失败: %s", e, exc_info=True)
+
+    def pipeline(self, batch_size=100):
+        '''
+        Return a Pipeline queueing commands and sending them batch_size at a time.
+        '''
+        return Pipeline(self, batch_size)
+
+    def sets(self, mapping, expires=half_hour, batch_size=100):
+        '''
+        Set many keys: mapping of key -> object, in one round trip per batch_size keys.
+        '''
+        logger.debug('sets cache: keys = %s', len(mapping))
+        with self.pipeline(batch_size) as p:
+            for k, v in mapping.iteritems():
+                p.set(k, v, expires)
+
+    def hsets(self, name, mapping, batch_size=100):
+        '''
+        Set many fields of hash name: mapping of field -> object, in one round trip per batch_size fields.
+        '''
+        logger.debug('hsets cache: name = %s, keys = %s', name, len(mapping))
+        with self.pipeline(batch_size) as p:
+            for k, v in mapping.iteritems():
+                p.hset(name, k, v)
+
+    def hgets(self, name, keys):
+        '''
+        Get many fields of hash name with HMGET, return list of object (None for missing fields), or -1 on error.
+        '''
+        logger.debug('hgets cache: name = %s, keys = %s', name, keys)
+        keys = list(keys)
+        try:
+            if self._local is None:
+                return map(self._serializer.loads, self._client.hmget(name, keys)) if keys else []
+            payloads = [self._local.get((name, k)) for k in keys]
+            missing = [k for k, p in zip(keys, payloads) if p is None]
+            self._local.hits += len(keys) - len(missing)
+            if missing:
+                self._local.misses += len(missing)
+                fetched, ttl = self._fetch(lambda p: p.hmget(name, missing), name)
+                fetched = dict(zip(missing, fetched))
+                for k in missing:
+                    self._local.put((name, k), fetched[k], ttl)
+                payloads = [fetched[k] if p is None else p for k, p in zip(keys, payloads)]
+            return map(self._serializer.loads, payloads)
+        except RedisError, e:
+            logger.error("hgets cache 失败: %s", e, exc_info=True)
+            return -1
+
+    def deletes(self, keys, batch_size=100):
+        '''
+        Delete many keys, in one round trip per batch_size keys.
+        '''
+        logger.debug('deletes cache: keys = %s', keys)
+        with self.pipeline(batch_size) as p:
+            for k in keys:
+                p.delete(k)
+
+    def hdels(self, name, keys, batch_size=100):
+        '''
+        Delete many fields of hash name, in one round trip per batch_size fields.
+        '''
+        logger.debug('hdels cache: name = %s, keys = %s', name, keys)
+        with self.pipeline(batch_size) as p:
+            for k in keys:
+                p.hdel(name, k)
+
+    def expires(self, keys, seconds, batch_size=100):
+        '''
+        Set the TTL of many keys to seconds, in one round trip per batch_size keys.
+        '''
+        logger.debug('expires cache: keys = %s', len(keys))
+        with self.pipeline(batch_size) as p:
+            for k in keys:
+                p.expire(k, seconds)
+
+    def setbits(self, key, offsets, batch_size=1000):
+        '''
+        Set the bits at offsets of the bitmap key to 1, in one round trip per batch_size bits. Return False on error.
+        '''
+        logger.debug('setbits cache: key = %s, bits = %s', key, len(offsets))
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            for i in xrange(0, len(offsets), batch_size):
+                for o in offsets[i:i + batch_size]:
+                    pipe.setbit(key, o, 1)
+                pipe.execute()
+            return True
+        except RedisError, e:
+            logger.error("setbits cache 失败: %s", e, exc_info=True)
+            return False
+
+    def getbits(self, key, offsets):
+        '''
+        Get the bits at offsets of the bitmap key in one round trip, return list of 0 / 1, or -1 on error.
+        '''
+        logger.debug('getbits cache: key = %s, bits = %s', key, len(offsets))
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            for o in offsets:
+                pipe.getbit(key, o)
+            return pipe.execute()
+        except RedisError, e:
+            logger.error("getbits cache 失败: %s", e, exc_info=True)
+            return -1
+
+    def exists(self, key):
+        '''
+        Return whether key exists, None on error.
+        '''
+        try:
+            return bool(self._client.exists(key))
+        except RedisError, e:
+            logger.error("exists cache 失败: %s", e, exc_info=True)
+            return None
+
+    def run_script(self, source, keys=(), args=()):
+        '''
+        Run the Lua script source by EVALSHA, loading it into Redis on first use. Return the script reply, or -1 on
+        error.
+        '''
+        logger.debug('run_script cache: keys = %s', keys)
+        script = self._scripts.get(source)
+        if script is None:
+            script = self._scripts[source] = self._client.register_script(source)
+        try:
+            return script(keys=keys, args=args)
+        except RedisError, e:
+            logger.error("run_script cache 失败: %s", e, exc_info=True)
+            return -1
+
+    def after_fork(self):
+        '''
+        Drop the connections inherited from the parent process, without closing them under it, and restart the
+        invalidation listener of the local tier.
+        '''
+        self._pool.reset()
+        if self._local is not None:
+            self._local.after_fork()
+            if self._local.channel:
+                self._local.listen(self._client)
+
+    def raw(self):
+        '''
+        Return the underlying redis.Redis, e.g. for pub/sub.
+        '''
+        return self._client
+
+    def local_stats(self):
+        '''
+        Return the local tier stats as Dict (items, bytes, hits, misses, shared, evictions, invalidations, hit_ratio),
+        or None without local tier.
+        '''
+        return None if self._local is None else self._local.stats()
+
+
+class AsyncRedisClient(object):
+    '''
+    Non-blocking RedisClient for tornado handlers: every method returns a Future of what RedisClient returns, errors
+    are handled the same way. Commands run on max_workers threads over a pool of as many connections, each command
+    is limited to timeout seconds. Key prefixes, serializer and local tier are shared with the blocking client.
+    c = yield async_redis_cache.get(key)
+    '''
+
+    def __init__(self, local_cache=None, serializer=None, max_workers=20, timeout=0.5):
+        self._client = RedisClient(local_cache, serializer, max_connections=max_workers, socket_timeout=timeout)
+        self._max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _submit(self, fn, *args, **kw):
+        start = time.time()
+        return metrics.attribute('redis', self._executor.submit(fn, *args, **kw), start)
+
+    def set(self, key, value, expires=half_hour):
+        return self._submit(self._client.set, key, value, expires)
+
+    def hset(self, name, key, value):
+        return self._submit(self._client.hset, name, key, value)
+
+    def get(self, key, default=None):
+        return self._submit(self._client.get, key, default)
+
+    def hget(self, name, key, default=None):
+        return self._submit(self._client.hget, name, key, default)
+
+    def gets(self, *keys):
+        return self._submit(self._client.gets, *keys)
+
+    def delete(self, key):
+        return self._submit(self._client.delete, key)
+
+    def hdel(self, name, key):
+        return self._submit(self._client.hdel, name, key)
+
+    def sets(self, mapping, expires=half_hour, batch_size=100):
+        return self._submit(self._client.sets, mapping, expires, batch_size)
+
+    def hsets(self, name, mapping, batch_size=100):
+        return self._submit(self._client.hsets, name, mapping, batch_size)
+
+    def hgets(self, name, keys):
+        return self._submit(self._client.hgets, name, keys)
+
+    def deletes(self, keys, batch_size=100):
+        return self._submit(self._client.deletes, keys, batch_size)
+
+    def hdels(self, name, keys, batch_size=100):
+        return self._submit(self._client.hdels, name, keys, batch_size)
+
+    def expires(self, keys, seconds, batch_size=100):
+        return self._submit(self._client.expires, keys, seconds, batch_size)
+
+    def setbits(self, key, offsets, batch_size=1000):
+        return self._submit(self._client.setbits, key, offsets, batch_size)
+
+    def getbits(self, key, offsets):
+        return self._submit(self._client.getbits, key, offsets)
+
+    def exists(self, key):
+        return self._submit(self._client.exists, key)
+
+    def run_script(self, source, keys=(), args=()):
+        return self._submit(self._client.run_script, source, keys, args)
+
+    def after_fork(self):
+        '''
+        Drop the connections and the threads inherited from the parent process. The local tier is shared with
+        redis_cache, which resets it.
+        '''
+        self._client._pool.reset()
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+
+    def local_stats(self):
+        return self._client.local_stats()
 
 
-redis_cache = RedisClient()
+redis_cache = RedisClient(LocalCache(**redis_local_cache_param) if redis_local_cache_param else None,
+                          Serializer(**redis_serializer_param))
+async_redis_cache = AsyncRedisClient(redis_cache._local, redis_cache._serializer, **redis_async_param)
 
 
+def after_fork():
+    '''
+    Reinitialize the module clients in a forked worker process, before it uses them.
+    '''
+    redis_cache.after_fork()
+    async_redis_cache.after_fork()
@@ -0,0 +1,391 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Captcha rendering. The font is loaded once and every character is pre-rasterized into an alpha mask, noise lines
+and speckles are drawn with numpy in one pass each, and the RGBX buffer is JPEG-encoded once.
+'''
+
+import os
+import time
+import random
+import string
+import StringIO
+import threading
+import collections
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from concurrent.futures import ProcessPoolExecutor
+import config
+from config import logger
+from utils import Dict, done_future
+import metrics
+
+chars = string.letters + string.digits  # 验证码字符
+
+
+def random_code(length=4):
+    return "".join(random.sample(chars, length))
+
+
+class CaptchaRenderer(object):
+    '''
+    Args:
+      size: image (width, height).
+      font_path: TrueType font of the characters.
+      font_size: font size in pixels.
+      lines: number of noise lines.
+      speckles: number of noise pixels.
+      quality: JPEG quality.
+
+    r = CaptchaRenderer()
+    jpeg = r.render('a1B2')
+    '''
+
+    def __init__(self, size=(90, 40), font_path=None, font_size=40, lines=200, speckles=1000, quality=75):
+        self.width, self.height = size
+        self.lines = lines
+        self.speckles = speckles
+        self.quality = quality
+        font = ImageFont.truetype((font_path or config.font_type).replace("\\", "/"), font_size)
+        self._glyphs = dict((c, self._rasterize(font, c)) for c in chars)
+        # sample points along every line, enough for the longest possible one.
+        self._steps = np.linspace(0.0, 1.0, max(self.width, self.height) + 1).astype(np.float32)
+        self._rng = np.random.RandomState()
+
+    def _rasterize(self, font, c):
+        w, h = font.getsize(c)
+        im = Image.new('L', (w, h), 0)
+        ImageDraw.Draw(im).text((0, 0), c, font=font, fill=255)
+        box = im.getbbox()
+        if box is None:
+            return 0, 0, np.zeros((0, 0, 1), np.float32)
+        mask = np.asarray(im.crop(box), np.float32)[:, :, None] / 255.0
+        return box[0], box[1], mask
+
+    def reseed(self, seed=None):
+        '''
+        Reseed the noise generator, needed after fork so that processes do not draw the same noise.
+        '''
+        self._rng.seed(seed)
+
+    def _colors(self, n, low, high):
+        '''
+        Return n random colors with channels in [low, high], packed as RGBX pixels (uint32, shape (n, 1)).
+        '''
+        c = np.zeros((n, 4), np.uint8)
+        c[:, :3] = self._rng.randint(low, high + 1, (n, 3))
+        return c.view(np.uint32)
+
+    def _draw_lines(self, flat):
+        rng = self._rng
+        w, h = self.width, self.height
+        # end points in [0, width] x [0, height], like random.randint(0, width).
+        bound = np.array([w + 1, h + 1], np.float32)
+        p1 = (rng.random_sample((self.lines, 2)) * bound).astype(np.int32)
+        p2 = (rng.random_sample((self.lines, 2)) * bound).astype(np.int32)
+        d = (p2 - p1).astype(np.float32)
+        # (lines, steps) pixel coordinates of every line, clipped like PIL clips the end points.
+        xs = (p1[:, 0:1] + d[:, 0:1] * self._steps + 0.5).astype(np.intp)
+        ys = (p1[:, 1:2] + d[:, 1:2] * self._steps + 0.5).astype(np.intp)
+        np.minimum(xs, w - 1, out=xs)
+        np.minimum(ys, h - 1, out=ys)
+        flat[ys * w + xs] = self._colors(self.lines, 130, 250)
+
+    def _draw_text(self, pixels, code):
+        x = 5
+        y = 2
+        for c in code:
+            dx, dy, mask = self._glyphs[c]
+            x0, y0 = x + dx, y + dy
+            x1, y1 = min(x0 + mask.shape[1], self.width), min(y0 + mask.shape[0], self.height)
+            if x1 > x0 and y1 > y0:
+                a = mask[:y1 - y0, :x1 - x0]
+                color = self._rng.randint(0, 131, 3).astype(np.float32)
+                region = pixels[y0:y1, x0:x1, :3]
+                region[:] = region * (1.0 - a) + color * a
+            x += 20
+
+    def _draw_speckles(self, flat):
+        rng = self._rng
+        xs = rng.randint(0, self.width, self.speckles)
+        ys = rng.randint(0, self.height, self.speckles)
+        flat[ys * self.width + xs] = self._colors(self.speckles, 20, 250)[:, 0]
+
+    def render(self, code):
+        '''
+        Return the JPEG bytes of code drawn over noise lines, under noise pixels.
+        '''
+        # one uint32 per RGBX pixel, so a noise pixel is a single store.
+        flat = np.empty(self.height * self.width, np.uint32)
+        flat.fill(0xffffffff)
+        self._draw_lines(flat)
+        self._draw_text(flat.view(np.uint8).reshape(self.height, self.width, 4), code)
+        self._draw_speckles(flat)
+        mem = StringIO.StringIO()
+        im = Image.frombuffer('RGB', (self.width, self.height), flat, 'raw', 'RGBX', 0, 1)
+        im.save(mem, "JPEG", quality=self.quality)
+        return mem.getvalue()
+
+
+_renderer = None
+_renderer_pid = None
+
+
+def get_renderer():
+    '''
+    Return the renderer of this process, created on first use. A forked process reseeds the random generators it
+    inherited, so that it does not draw the same codes and noise as its parent.
+    '''
+    global _renderer, _renderer_pid
+    if _renderer is None:
+        _renderer = CaptchaRenderer(**config.captcha_param)
+        _renderer_pid = os.getpid()
+    elif _renderer_pid != os.getpid():
+        random.seed()
+        _renderer.reseed()
+        _renderer_pid = os.getpid()
+    return _renderer
+
+
+def generate():
+    '''
+    Return a new (code, JPEG bytes) pair.
+    '''
+    renderer = get_renderer()
+    code = random_code()
+    return code, renderer.render(code)
+
+
+def _generate_many(n):
+    # runs in the pool processes.
+    return [generate() for i in xrange(n)]
+
+
+class CaptchaPool(object):
+    '''
+    Ring buffer of pre-rendered (code, JPEG bytes) pairs, refilled by a background thread from worker processes
+    whenever it holds less than low_water entries.
+
+    Args:
+      size: maximum number of entries.
+      low_water: refill starts below this many entries and goes on until the pool is full.
+      batch: entries rendered by one worker call.
+      processes: worker processes rendering in parallel.
+      rate: maximum entries rendered per second, 0 for no limit.
+      reuse: when the pool is empty, hand out one of the last served entries again instead of rendering inline.
+
+    pool = CaptchaPool().start()
+    code, jpeg = pool.pop()
+    '''
+
+    def __init__(self, size=1000, low_water=300, batch=50, processes=2, rate=1000, reuse=False):
+        self.size = size
+        self.low_water = min(low_water, size)
+        self.batch = batch
+        self.processes = processes
+        self.rate = rate
+        self.reuse = reuse
+        self._entries = collections.deque(maxlen=size)
+        self._served = collections.deque(maxlen=min(size, 100))
+        self._wakeup = threading.Event()
+        self._executor = None
+        self._thread = None
+        self._closed = False
+        self.served = 0
+        self.underflows = 0
+        self.reused = 0
+        self.rendered = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread is None:
+            self._executor = ProcessPoolExecutor(self.processes)
+            self._thread = threading.Thread(target=self._refill, name='captcha-pool')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def pop(self):
+        '''
+        Return a (code, JPEG bytes) pair, taken from the pool if it is not empty.
+        '''
+        entry = self.try_pop()
+        return entry if entry is not None else generate()
+
+    def try_pop(self):
+        '''
+        Return a (code, JPEG bytes) pair from the pool, None if it is empty and reuse is off.
+        '''
+        try:
+            entry = self._entries.popleft()
+        except IndexError:
+            entry = None
+        if len(self._entries) < self.low_water:
+            self._wakeup.set()
+        self.served += 1
+        if entry is not None:
+            if self.reuse:
+                self._served.append(entry)
+            return entry
+        self.underflows += 1
+        if self.reuse and self._served:
+            self.reused += 1
+            return random.choice(self._served)
+        return None
+
+    def _refill(self):
+        while not self._closed:
+            if len(self._entries) >= self.low_water:
+                self._wakeup.wait(1)
+                self._wakeup.clear()
+                continue
+            while not self._closed and len(self._entries) < self.size:
+                started = time.time()
+                missing = self.size - len(self._entries)
+                counts = [min(self.batch, missing - i) for i in xrange(0, missing, self.batch)][:self.processes]
+                try:
+                    futures = [self._executor.submit(_generate_many, n) for n in counts]
+                    for f in futures:
+                        entries = f.result()
+                        self._entries.extend(entries)
+                        self.rendered += len(entries)
+                except Exception, e:
+                    self.errors += 1
+                    logger.error('生成验证码失败: %s', e)
+                    time.sleep(1)
+                    continue
+                if self.rate:
+                    time.sleep(max(0, sum(counts) / float(self.rate) - (time.time() - started)))
+
+    def stats(self):
+        return Dict(depth=len(self._entries), size=self.size, served=self.served, underflows=self.underflows,
+                    reused=self.reused, rendered=self.rendered, errors=self.errors)
+
+
+_pool = None
+_pool_pid = None
+
+
+def get_pool():
+    '''
+    Return the captcha pool of this process, started on first use, None if config.captcha_pool_param is None.
+    A forked process starts its own pool, the refill thread of the parent does not survive the fork.
+    '''
+    global _pool, _pool_pid
+    if config.captcha_pool_param is None:
+        return None
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = CaptchaPool(**config.captcha_pool_param).start()
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def pool_stats():
+    '''
+    Return the stats of the captcha pool of this process as Dict (see CaptchaPool.stats), None if it is not started.
+    '''
+    return _pool.stats() if _pool is not None and _pool_pid == os.getpid() else None
+
+
+class RenderPool(object):
+    '''
+    Renders captchas in worker processes, so the IOLoop thread neither renders nor holds the GIL meanwhile.
+
+    Args:
+      processes: worker processes.
+      max_pending: renders submitted and not finished yet, above which render() falls back to rendering inline.
+
+    pool = RenderPool()
+    code, jpeg = yield pool.render()
+    '''
+
+    def __init__(self, processes=2, max_pending=8):
+        self.processes = processes
+        self.max_pending = max_pending
+        self._executor = ProcessPoolExecutor(processes)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.inline = 0
+        self.errors = 0
+
+    def render(self):
+        '''
+        Return a Future of a new (code, JPEG bytes) pair.
+        '''
+        with self._lock:
+            saturated = self.pending >= self.max_pending
+            if not saturated:
+                self.pending += 1
+                self.submitted += 1
+        if saturated:
+            self.inline += 1
+            return done_future(generate())
+        try:
+            f = self._executor.submit(generate)
+        except Exception, e:
+            # broken or shut down executor.
+            self._finished(None)
+            self.errors += 1
+            logger.error('提交验证码生成失败: %s', e)
+            return done_future(generate())
+        f.add_done_callback(self._finished)
+        return f
+
+    def _finished(self, f):
+        with self._lock:
+            self.pending -= 1
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        return Dict(pending=self.pending, max_pending=self.max_pending, submitted=self.submitted, inline=self.inline,
+                    errors=self.errors)
+
+
+_render_pool = None
+_render_pool_pid = None
+
+
+def get_render_pool():
+    '''
+    Return the render pool of this process, created on first use, None if config.captcha_render_param is None.
+    '''
+    global _render_pool, _render_pool_pid
+    if config.captcha_render_param is None:
+        return None
+    if _render_pool is None or _render_pool_pid != os.getpid():
+        _render_pool = RenderPool(**config.captcha_render_param)
+        _render_pool_pid = os.getpid()
+    return _render_pool
+
+
+def render_pool_stats():
+    '''
+    Return the stats of the render pool of this process as Dict (see RenderPool.stats), None if it is not created.
+    '''
+    return _render_pool.stats() if _render_pool is not None and _render_pool_pid == os.getpid() else None
+
+
+def take_async():
+    '''
+    Return a Future of a (code, JPEG bytes) pair: from the pool when it has one, else rendered by the render pool,
+    else rendered inline.
+    '''
+    start = time.time()
+    pool = get_pool()
+    entry = pool.try_pop() if pool is not None else None
+    if entry is not None:
+        f = done_future(entry)
+    else:
+        render_pool = get_render_pool()
+        f = render_pool.render() if render_pool is not None else done_future(generate())
+    return metrics.attribute('captcha', f, start)
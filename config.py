@@ -4,13 +4,93 @@ __author__ = 'chenghao'
 import logging
 import logging.handlers
 import os
+from asynclog import QueueHandler
 
 
 # 访问该项目的前缀, 如http://ip:port/websetup/XX
 url_prefix = "/websetup"
+# 运行配置, 启动时用 --profile 选择
+# xheaders: 在nginx等反向代理后运行时为True, 客户端ip(限流按ip计数)取自代理加的X-Real-Ip / X-Forwarded-For头;
+# 直接对外提供服务时须为False, 否则客户端可以伪造ip
+app_profiles = {
+    # 开发: 修改代码后自动重载, 模板每次请求重新编译
+    "dev": {"debug": True, "precompile_templates": [], "log_level": "INFO", "require_cookie_secret": False,
+            "xheaders": False},
+    # 生产: 在nginx后运行, 关闭debug, 启动时预编译模板, 必须配置cookie签名密钥
+    "prod": {"debug": False, "precompile_templates": ["user/*.html"], "log_level": "INFO",
+             "require_cookie_secret": True, "xheaders": True},
+    # 压测: 同生产, 但直接对外提供服务, 不输出每条sql的INFO日志, 可不配置cookie签名密钥
+    "bench": {"debug": False, "precompile_templates": ["user/*.html"], "log_level": "WARNING",
+              "require_cookie_secret": False, "xheaders": False}
+}
 
 # 字体类型
-font_type = os.path.abspath("../web_setup/static/fonts/calibri.ttf")
+font_type = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static/fonts/calibri.ttf")
+# 验证码图片
+captcha_param = {
+    "size": (90, 40),  # 图片大小
+    "font_size": 40,  # 字体大小
+    "lines": 200,  # 干扰线数
+    "speckles": 1000  # 干扰像素点数
+}
+# 预先生成的验证码池, 设为None时每次请求现场生成
+captcha_pool_param = {
+    "size": 1000,  # 池中最多保存的验证码数
+    "low_water": 300,  # 少于该数量时后台开始补充
+    "batch": 50,  # 每个进程每次生成的数量
+    "processes": 2,  # 生成验证码的进程数
+    "rate": 1000,  # 每秒最多生成的数量, 0为不限制
+    "reuse": False  # 池空时是否重复使用最近发出的验证码, 否则现场生成
+}
+# 在子进程中生成验证码, 不占用IOLoop线程, 设为None时在IOLoop线程中生成
+captcha_render_param = {
+    "processes": 2,  # 生成验证码的进程数
+    "max_pending": 8  # 最多同时等待生成的数量, 超过时在IOLoop线程中生成
+}
+# cookie签名密钥, 各服务器须一致, 不能写在代码中: 取自环境变量WEBSETUP_COOKIE_SECRET,
+# 或环境变量WEBSETUP_COOKIE_SECRET_FILE指向的文件. 都没有时为None, 非prod运行时使用本次启动随机生成的密钥
+_cookie_secret_file = os.environ.get("WEBSETUP_COOKIE_SECRET_FILE")
+cookie_secret = os.environ.get("WEBSETUP_COOKIE_SECRET") or (
+    open(_cookie_secret_file).read().strip() if _cookie_secret_file else None)
+# 会话
+session_param = {
+    "cookie": "websetup_sid",  # 保存会话id的cookie名
+    "expires": 30 * 60,  # 会话无访问后过期的秒数
+    "refresh_window": 60  # 该秒数内的续期合并为一次批量EXPIRE
+}
+# 密码哈希(PBKDF2-SHA256)
+password_param = {
+    "iterations": 100000,  # 迭代次数, 修改后用户登录时自动按新参数重新哈希
+    "max_workers": 4,  # 最多同时计算的哈希数
+    "processes": False  # True时在子进程中计算, 否则在线程中计算(计算时不占用GIL); 没有OpenSSL时总在子进程中计算
+}
+# 限流(令牌桶), 每个接口按各维度分别计数, 任一维度超限即返回429
+rate_limits = {
+    # 接口: {维度: (每秒补充的次数, 最多连续的次数)}
+    "login": {"ip": (1, 20), "loginName": (0.1, 5)},
+    "verCode": {"ip": (2, 30), "imei": (0.2, 5)}
+}
+rate_limit_param = {
+    "prefilter_size": 10000  # 进程内记住的已超限key数, 在其恢复前直接拒绝, 不再访问redis
+}
+# 已有登录名的布隆过滤器, 注册时过滤器中不存在的登录名直接插入(由唯一索引防止重复), 设为None关闭
+login_filter_param = {
+    "capacity": 1000000,  # 预计的用户数
+    "error_rate": 0.01,  # 达到预计用户数时的误判率
+    "shared": False  # True时保存在redis位图中, 各进程共用; 否则每个进程启动时各自从数据库建立
+}
+# SQL统计, 按去掉字面量后的语句分组, 由 url_prefix + "/metrics" 导出
+metrics_param = {
+    "slow_threshold": 0.1,  # 超过该秒数的语句记WARNING日志, 设为None关闭
+    "sample_rate": 0.001,  # 其余语句按该比例抽样记INFO日志, 设为0关闭
+    "max_fingerprints": 500  # 最多统计的语句数, 超出的计入"other"
+}
+# 请求耗时统计, 按handler统计耗时, 并分出等待数据库、redis、密码哈希、验证码的时间
+request_timing_param = {
+    "server_timing": False,  # True时在响应中加Server-Timing头, 浏览器开发者工具中可见
+    "slow_threshold": 1,  # 超过该秒数的请求记WARNING日志, 设为None关闭
+    "sample_rate": 0.01  # 其余请求按该比例抽样记INFO日志, 设为0关闭
+}
 
 # 按每天生成日志文件 linux (win是存放在该项目的所在盘下)
 # logHandler = logging.handlers.TimedRotatingFileHandler("/data/logs/hao", "D", 1)  # 服务器
@@ -18,9 +98,20 @@ logHandler = logging.handlers.TimedRotatingFileHandler("/home/chenghao/logs/webs
 # 格式化日志内容
 logFormatter = logging.Formatter('%(asctime)s %(name)-5s %(levelname)-5s %(message)s')
 logHandler.setFormatter(logFormatter)
+# 后台线程批量写日志, 队列满时丢弃并计数, 设为None时在调用线程中直接写文件
+log_queue_param = {
+    "max_size": 10000,  # 最多等待写入的日志条数
+    "batch_size": 500,  # 每次最多写入的条数
+    "interval": 0.05  # 队列为空时写日志线程等待的秒数
+}
+# 日志格式不含文件名、行号、线程、进程, 不必在每条日志中收集
+logging._srcfile = None
+logging.logThreads = 0
+logging.logProcesses = 0
+logQueueHandler = None if log_queue_param is None else QueueHandler(logHandler, **log_queue_param)
 # 设置记录器名字
 logger = logging.getLogger('websetup')
-logger.addHandler(logHandler)
+logger.addHandler(logHandler if logQueueHandler is None else logQueueHandler)
 # 设置日志等级
 logger.setLevel(logging.INFO)
 
@@ -35,8 +126,42 @@ mysql_param = {
     "password": "123456",
     "use_unicode": True
 }
+# mysql连接池
+mysql_pool_param = {
+    "pool_min_size": 2,  # 启动时预先建立的连接数
+    "pool_max_size": 20,  # 最大连接数
+    "pool_idle_timeout": 300,  # 空闲连接超过该秒数后关闭(保留min_size个)
+    "pool_recycle": 3600,  # 连接使用超过该秒数后重建
+    "pool_timeout": 10,  # 获取连接时最多等待的秒数
+    "pool_ping_interval": 30  # 空闲超过该秒数的连接取出时先ping, 0为每次取出都ping
+}
+# 查询结果缓存, 写表时自动失效
+query_cache_param = {
+    "max_size": 10000,  # 进程内最多缓存的查询数
+    "channel": "websetup_query_invalidate"  # 多进程时各进程间同步失效的redis频道
+}
+query_cache_ttl = 60  # 查询结果缓存的秒数
 # redis
 redis_param = {
     "host": "127.0.0.1",
     "port": 6379
+}
+# 非阻塞redis客户端
+redis_async_param = {
+    "max_workers": 20,  # 线程数, 也是连接数
+    "timeout": 0.5  # 每个命令最多等待的秒数
+}
+# redis前的进程内缓存, 设为None关闭
+redis_local_cache_param = {
+    "max_items": 10000,  # 最多缓存的key数
+    "max_bytes": 32 * 1024 * 1024,  # 最多占用的内存
+    "ttl": 5,  # 最多缓存的秒数, 不超过redis中的过期时间
+    "channel": "websetup_cache_invalidate"  # 多进程间同步失效的redis频道
+}
+# redis缓存值的序列化
+redis_serializer_param = {
+    "codec": "pickle",  # pickle, json, msgpack
+    "compress": "zlib",  # zlib, lz4, None
+    "compress_threshold": 1024,  # 超过该字节数才压缩
+    "legacy": False  # 滚动升级时先设为True, 写旧格式, 所有进程升级后再改为False
 }
\ No newline at end of file
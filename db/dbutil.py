@@ -5,17 +5,23 @@ __author__ = 'chenghao'
 Database operation module. This module is independent with web module.
 '''
 
-import time, functools, threading
+import sys, time, functools, threading
 from config import logger
-from utils import Dict
+from utils import Dict, LRUCache
+from pool import ConnectionPool
+from rows import row_class
+from query_cache import QueryCache, written_table
+from concurrent.futures import ThreadPoolExecutor
+import metrics
 
 
-def _profiling(start, sql=''):
+def _profiling(start, sql='', rows=None, error=False):
     t = time.time() - start
-    if t > 0.1:
-        logger.warning('[PROFILING] [DB] %s: %s' % (t, sql))
-    else:
-        logger.info('[PROFILING] [DB] %s: %s' % (t, sql))
+    metrics.registry.query(sql, t, rows, error)
+    timing = metrics.current()
+    if timing is not None:
+        # blocking call made by a request on the IOLoop thread, *_async calls are attributed by _submit.
+        timing.add('db', t)
 
 
 class DBError(Exception):
@@ -26,8 +32,15 @@ class MultiColumnsError(DBError):
     pass
 
 
-def _log(s):
-    logger.debug(s)
+class IntegrityError(DBError):
+    '''
+    A write violated a constraint, e.g. a duplicate value of a unique key. Wraps the driver's IntegrityError.
+    '''
+    pass
+
+
+def _log(msg, *args):
+    logger.debug(msg, *args)
 
 
 def _dummy_connect():
@@ -39,30 +52,138 @@ def _dummy_connect():
 
 _db_connect = _dummy_connect
 _db_convert = '?'
+_db_type = None
+_db_stream_cursor = None
+_db_integrity_errors = ()
+_db_pool = None
+_db_executor = None
+_db_executor_lock = threading.Lock()
+_query_cache = None
+# compiled statements built by insert() and update_kw(): ('insert', table, cols) or ('update', table, cols, where)
+# -> driver SQL. Hand written SQL is not cached, one str.replace is cheaper than a cache lookup.
+_stmt_cache = LRUCache(256)
+
+
+def _dict_rows(names):
+    return functools.partial(Dict, names)
+
+
+# names -> function(values) building a result row, see use_compact_rows().
+_row_factory = _dict_rows
+
+
+def use_compact_rows(enabled=True):
+    '''
+    Return rows as compact read-only rows.Row objects instead of utils.Dict for all selects. Rows keep row.col and
+    row['col'] access, use json.dumps(obj, default=rows.json_default) to serialize them.
+    '''
+    global _row_factory
+    _row_factory = row_class if enabled else _dict_rows
+
+
+def _compile(sql):
+    '''
+    Return sql with '?' placeholders converted for the driver.
+    '''
+    if _db_convert == '?':
+        return sql
+    return sql.replace('?', _db_convert)
+
+
+def _insert_sql(table, cols):
+    key = ('insert', table, cols)
+    sql = _stmt_cache.get(key)
+    if sql is None:
+        sql = 'insert into %s (%s) values (%s)' % (table, ','.join(cols), ','.join([_db_convert for c in cols]))
+        _stmt_cache.set(key, sql)
+    return sql
+
+
+def _update_kw_sql(table, cols, where):
+    key = ('update', table, cols, where)
+    sql = _stmt_cache.get(key)
+    if sql is None:
+        sql = _compile(' '.join(['update', table, 'set', ', '.join(['%s=?' % c for c in cols]), 'where', where]))
+        _stmt_cache.set(key, sql)
+    return sql
+
+
+def _upsert_sql(table, cols, conflict_cols):
+    key = ('upsert', table, cols, conflict_cols)
+    sql = _stmt_cache.get(key)
+    if sql is None:
+        updates = [c for c in cols if c not in conflict_cols]
+        if _db_type == 'mysql':
+            if updates:
+                action = ', '.join(['%s=values(%s)' % (c, c) for c in updates])
+            else:
+                # no column left to update, assign a key column to itself so the duplicate is ignored.
+                action = '%s=%s' % (conflict_cols[0], conflict_cols[0])
+            sql = '%s on duplicate key update %s' % (_insert_sql(table, cols), action)
+        elif _db_type == 'sqlite3':
+            if updates:
+                action = 'do update set %s' % ', '.join(['%s=excluded.%s' % (c, c) for c in updates])
+            else:
+                action = 'do nothing'
+            sql = '%s on conflict (%s) %s' % (_insert_sql(table, cols), ','.join(conflict_cols), action)
+        else:
+            raise DBError('upsert is not supported by db: %s' % _db_type)
+        _stmt_cache.set(key, sql)
+    return sql
+
+
+def statement_cache_stats():
+    '''
+    Return compiled statement cache stats as Dict: size, max_size, hits, misses, evictions.
+    '''
+    return Dict(size=len(_stmt_cache), max_size=_stmt_cache.max_size, hits=_stmt_cache.hits,
+                misses=_stmt_cache.misses, evictions=_stmt_cache.evictions)
 
 
 class _LasyConnection(object):
     def __init__(self):
         self.connection = None
+        self.pool = None
+        self.pooled = None
+        # a statement ran since the last commit / rollback, the driver may hold a transaction open.
+        self.in_transaction = False
 
-    def cursor(self):
+    def cursor(self, cursorclass=None):
         if self.connection is None:
-            _log('open connection...')
-            self.connection = _db_connect()
+            if _db_pool is None:
+                _log('open connection...')
+                self.connection = _db_connect()
+            else:
+                _log('borrow connection...')
+                self.pool = _db_pool
+                self.pooled = self.pool.acquire()
+                self.connection = self.pooled.raw
+        self.in_transaction = True
+        if cursorclass is not None:
+            return self.connection.cursor(cursorclass)
         return self.connection.cursor()
 
     def commit(self):
         self.connection.commit()
+        self.in_transaction = False
 
     def rollback(self):
         self.connection.rollback()
+        self.in_transaction = False
 
     def cleanup(self):
         if self.connection:
             connection = self.connection
+            pool, pooled = self.pool, self.pooled
             self.connection = None
-            _log('close connection...')
-            connection.close()
+            self.pool = self.pooled = None
+            if pooled is None:
+                _log('close connection...')
+                connection.close()
+            else:
+                _log('return connection...')
+                pool.release(pooled, self.in_transaction)
+            self.in_transaction = False
 
 
 class _DbCtx(threading.local):
@@ -73,6 +194,7 @@ class _DbCtx(threading.local):
     def __init__(self):
         self.connection = None
         self.transactions = 0
+        self.written_tables = set()
 
     def is_init(self):
         return not self.connection is None
@@ -81,15 +203,17 @@ class _DbCtx(threading.local):
         _log('open lazy connection...')
         self.connection = _LasyConnection()
         self.transactions = 0
+        self.written_tables = set()
 
     def cleanup(self):
         self.connection.cleanup()
+        self.connection = None
 
-    def cursor(self):
+    def cursor(self, cursorclass=None):
         '''
         Return cursor
         '''
-        return self.connection.cursor()
+        return self.connection.cursor(cursorclass)
 
 
 _db_ctx = _DbCtx()
@@ -169,10 +293,13 @@ class _TransactionCtx(object):
         _db_ctx.transactions = _db_ctx.transactions - 1
         try:
             if _db_ctx.transactions == 0:
-                if exctype is None:
-                    self.commit()
-                else:
-                    self.rollback()
+                try:
+                    if exctype is None:
+                        self.commit()
+                    else:
+                        self.rollback()
+                finally:
+                    _transaction_written()
         finally:
             if self.should_close_conn:
                 _db_ctx.cleanup()
@@ -221,37 +348,45 @@ def with_transaction(func):
 
 def _select(sql, first, *args):
     ' execute select SQL and return unique result or list results.'
-    global _db_ctx, _db_convert
+    global _db_ctx
     cursor = None
-    if _db_convert != '?':
-        sql = sql.replace('?', _db_convert)
-    _log('SQL: %s, ARGS: %s' % (sql, args))
+    sql = _compile(sql)
+    _log('SQL: %s, ARGS: %s', sql, args)
     start = time.time()
+    rows = 0
+    error = True
     try:
         cursor = _db_ctx.connection.cursor()
         cursor.execute(sql, args)
         if cursor.description:
-            names = [x[0] for x in cursor.description]
+            make = _row_factory(tuple([x[0] for x in cursor.description]))
         if first:
             values = cursor.fetchone()
+            error = False
             if not values:
                 return None
-            return Dict(names, values)
-        return [Dict(names, x) for x in cursor.fetchall()]
+            rows = 1
+            return make(values)
+        r = map(make, cursor.fetchall())
+        rows = len(r)
+        error = False
+        return r
     finally:
         if cursor:
             cursor.close()
-        _profiling(start, sql)
+        _profiling(start, sql, rows, error)
 
 
-@with_connection
-def select_one(sql, *args):
+def select_one(sql, *args, **kw):
     '''
     Execute select SQL and expected one result.
     If no result found, return None.
     If multiple results found, the first one returned.
+    Keyword only cache_ttl (seconds) and tags (table names, default to the tables after from / join) read the result
+    through the query cache, see init_query_cache():
+    > select_one('select * from user where loginName=?', 'bob', cache_ttl=60, tags=('user',))
     '''
-    return _select(sql, True, *args)
+    return _query(sql, True, args, kw)
 
 
 @with_connection
@@ -267,10 +402,10 @@ def select_int(sql, *args):
     return d.values()[0]
 
 
-@with_connection
-def select(sql, *args):
+def select(sql, *args, **kw):
     '''
     Execute select SQL and return list or empty list if no result.
+    Accepts the cache_ttl and tags keywords of select_one.
     > u1 = dict(id=200, name='Wall.E', email='wall.e@test.org', passwd='back-to-earth', last_modified=time.time())
     > u2 = dict(id=201, name='Eva', email='eva@test.org', passwd='back-to-earth', last_modified=time.time())
     > insert('user', **u1)
@@ -289,17 +424,105 @@ def select(sql, *args):
     > L[1].name
     u'Wall.E'
     '''
-    return _select(sql, False, *args)
+    return _query(sql, False, args, kw)
 
 
 @with_connection
+def _select_conn(sql, first, args):
+    return _select(sql, first, *args)
+
+
+def _query(sql, first, args, kw):
+    cache_ttl = kw.pop('cache_ttl', None)
+    tags = kw.pop('tags', None)
+    if kw:
+        raise TypeError('Unexpected keyword arguments: %s' % ', '.join(kw))
+    # inside a transaction we may see uncommitted rows, never cache them.
+    if not cache_ttl or _query_cache is None or _db_ctx.transactions:
+        return _select_conn(sql, first, args)
+    return _query_cache.get_or_load(sql, first, args, tags, cache_ttl, lambda: _select_conn(sql, first, args))
+
+
+def _written(table):
+    '''
+    Invalidate cached queries of table (all of them if table is None) after a write. Inside a transaction the table
+    is invalidated again when it ends, so reads racing with the transaction can not cache the old rows.
+    '''
+    if _query_cache is None:
+        return
+    tables = None if table is None else (table,)
+    _query_cache.invalidate(tables)
+    if _db_ctx.transactions:
+        _db_ctx.written_tables.add(table)
+
+
+def _transaction_written():
+    written = _db_ctx.written_tables
+    if written and _query_cache is not None:
+        _query_cache.invalidate(None if None in written else written)
+    written.clear()
+
+
+def select_iter(sql, *args, **kw):
+    '''
+    Execute select SQL and return a generator of rows, fetched batch_size rows at a time (keyword only, default to
+    1000). On mysql an unbuffered server side cursor (SSCursor) is used, so memory stays flat whatever the result size.
+    The connection context stays open until the generator is exhausted or closed, do not run other statements on the
+    same thread meanwhile: mysql cannot run a query while an unbuffered result is pending.
+    > for u in select_iter('select * from user where passwd=?', 'back-to-earth', batch_size=100):
+    >     print u.name
+    '''
+    batch_size = kw.pop('batch_size', 1000)
+    if kw:
+        raise TypeError('Unexpected keyword arguments: %s' % ', '.join(kw))
+    if batch_size < 1:
+        raise ValueError('batch_size must be positive.')
+    return _select_iter(_compile(sql), batch_size, args)
+
+
+def _select_iter(sql, batch_size, args):
+    global _db_ctx
+    with _ConnectionCtx():
+        cursor = None
+        _log('SQL: %s, ARGS: %s', sql, args)
+        start = time.time()
+        n = 0
+        error = True
+        try:
+            cursor = _db_ctx.connection.cursor(_db_stream_cursor)
+            cursor.execute(sql, args)
+            make = _row_factory(tuple([x[0] for x in cursor.description]))
+            while True:
+                values = cursor.fetchmany(batch_size)
+                if not values:
+                    break
+                n += len(values)
+                for x in values:
+                    yield make(x)
+            error = False
+        finally:
+            if cursor:
+                cursor.close()
+            _profiling(start, sql, n, error)
+
+
 def _update(sql, args, post_fn=None):
-    global _db_ctx, _db_convert
+    try:
+        return _execute(_compile(sql), args, post_fn)
+    finally:
+        if _query_cache is not None:
+            _written(written_table(sql))
+
+
+@with_connection
+def _execute(sql, args, post_fn=None):
+    ' execute compiled update SQL and return row count.'
+    global _db_ctx
     cursor = None
-    if _db_convert != '?':
-        sql = sql.replace('?', _db_convert)
-    _log('SQL: %s, ARGS: %s' % (sql, args))
+    _log('SQL: %s, ARGS: %s', sql, args)
     start = time.time()
+    r = None
+    error = True
     try:
         cursor = _db_ctx.connection.cursor()
         cursor.execute(sql, args)
@@ -309,11 +532,14 @@ def _update(sql, args, post_fn=None):
             _log('auto commit')
             _db_ctx.connection.commit()
             post_fn and post_fn()
+        error = False
         return r
+    except _db_integrity_errors, e:
+        raise IntegrityError(str(e)), None, sys.exc_info()[2]
     finally:
         if cursor:
             cursor.close()
-        _profiling(start, sql)
+        _profiling(start, sql, r, error)
 
 
 def insert(table, **kw):
@@ -330,9 +556,90 @@ def insert(table, **kw):
       ...
     IntegrityError: column id is not unique
     '''
-    cols, args = zip(*kw.iteritems())
-    sql = 'insert into %s (%s) values (%s)' % (table, ','.join(cols), ','.join([_db_convert for i in range(len(cols))]))
-    return _update(sql, args)
+    cols = tuple(kw)
+    try:
+        return _execute(_insert_sql(table, cols), [kw[c] for c in cols])
+    finally:
+        _written(table)
+
+
+@with_connection
+def insert_many(table, rows, chunk_size=500):
+    '''
+    Execute insert SQL for many rows with executemany, chunk_size rows per round trip. All rows must have the columns
+    of the first row, a row with other columns raises ValueError. Without an open transaction each chunk is committed
+    on its own, the chunks before such a row stay inserted. Return row count of each chunk.
+    > insert_many('user', [dict(id=3000, name='A'), dict(id=3001, name='B'), dict(id=3002, name='C')], chunk_size=2)
+    [2, 1]
+    '''
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be positive.')
+    counts = []
+    it = iter(rows)
+    try:
+        first = next(it)
+    except StopIteration:
+        return counts
+    cols = tuple(first)
+    names = set(cols)
+    sql = _insert_sql(table, cols)
+    chunk = [[first[c] for c in cols]]
+    try:
+        for row in it:
+            if len(chunk) == chunk_size:
+                counts.append(_execute_many(sql, chunk))
+                chunk = []
+            if len(row) != len(cols) or set(row) != names:
+                raise ValueError('Row columns %s differ from the first row: %s' % (sorted(row), sorted(cols)))
+            chunk.append([row[c] for c in cols])
+        counts.append(_execute_many(sql, chunk))
+    finally:
+        _written(table)
+    return counts
+
+
+def _execute_many(sql, params):
+    ' execute compiled SQL once per params item in one round trip, commit if not in transaction.'
+    global _db_ctx
+    cursor = None
+    _log('SQL: %s, ROWS: %s', sql, len(params))
+    start = time.time()
+    r = None
+    error = True
+    try:
+        cursor = _db_ctx.connection.cursor()
+        cursor.executemany(sql, params)
+        r = cursor.rowcount
+        if _db_ctx.transactions == 0:
+            _log('auto commit')
+            _db_ctx.connection.commit()
+        error = False
+        return r
+    except _db_integrity_errors, e:
+        raise IntegrityError(str(e)), None, sys.exc_info()[2]
+    finally:
+        if cursor:
+            cursor.close()
+        _profiling(start, sql, r, error)
+
+
+def upsert(table, row, conflict_cols):
+    '''
+    Insert row, or update its other columns when a row with the same conflict_cols (a unique key) exists.
+    Maps to insert ... on duplicate key update on mysql and insert ... on conflict on sqlite3 (3.24+).
+    The row count follows the driver: mysql returns 1 for insert and 2 for update.
+    > upsert('user', dict(id=4000, name='Ann'), ('id',))
+    1
+    > upsert('user', dict(id=4000, name='Anna'), ('id',))
+    2
+    '''
+    if isinstance(conflict_cols, basestring):
+        conflict_cols = (conflict_cols,)
+    cols = tuple(row)
+    try:
+        return _execute(_upsert_sql(table, cols, tuple(conflict_cols)), [row[c] for c in cols])
+    finally:
+        _written(table)
 
 
 def update(sql, *args):
@@ -380,25 +687,155 @@ def update_kw(table, where, *args, **kw):
     '''
     if len(kw) == 0:
         raise ValueError('No kw args.')
-    sqls = ['update', table, 'set']
-    params = []
-    updates = []
-    for k, v in kw.iteritems():
-        updates.append('%s=?' % k)
-        params.append(v)
-    sqls.append(', '.join(updates))
-    sqls.append('where')
-    sqls.append(where)
-    sql = ' '.join(sqls)
+    cols = tuple(kw)
+    params = [kw[c] for c in cols]
     params.extend(args)
-    return update(sql, *params)
+    try:
+        return _execute(_update_kw_sql(table, cols, where), params)
+    finally:
+        _written(table)
+
+
+def init_query_cache(max_size=10000, client=None, channel=None):
+    '''
+    Enable the query cache used by select_one / select with cache_ttl, an in-process LRU of max_size results.
+    Args:
+      client, channel: redis.Redis and pub/sub channel sharing the invalidations with the other worker processes.
+    '''
+    global _query_cache
+    _query_cache = QueryCache(max_size, client, channel)
+    _query_cache.listen()
+
+
+def query_cache_stats():
+    '''
+    Return query cache counters as Dict: hits, misses, stores, invalidations, or None if the cache is disabled.
+    '''
+    return None if _query_cache is None else _query_cache.stats()
+
+
+def _get_executor():
+    '''
+    Return the executor running the *_async functions. It has as many threads as the pool has connections, so a
+    submitted query never waits for a connection while holding a thread.
+    '''
+    global _db_executor
+    if _db_executor is None:
+        with _db_executor_lock:
+            if _db_executor is None:
+                workers = 10 if _db_pool is None else _db_pool.max_size
+                _db_executor = ThreadPoolExecutor(max_workers=workers)
+    return _db_executor
 
 
-def init_connector(func_connect, convert_char='%s'):
-    global _db_connect, _db_convert
+def _submit(fn, *args, **kw):
+    # the time until the result is ready, waiting for a thread included, counts as db time of the current request.
+    start = time.time()
+    return metrics.attribute('db', _get_executor().submit(fn, *args, **kw), start)
+
+
+def select_one_async(sql, *args, **kw):
+    '''
+    Same as select_one but run on the db executor. Return a Future that can be yielded in a tornado coroutine:
+    user = yield select_one_async('select * from user where id=?', 1000)
+    '''
+    return _submit(select_one, sql, *args, **kw)
+
+
+def select_async(sql, *args, **kw):
+    '''
+    Same as select but run on the db executor, return a Future.
+    '''
+    return _submit(select, sql, *args, **kw)
+
+
+def insert_async(table, **kw):
+    '''
+    Same as insert but run on the db executor, return a Future.
+    '''
+    return _submit(insert, table, **kw)
+
+
+def update_async(sql, *args):
+    '''
+    Same as update but run on the db executor, return a Future.
+    '''
+    return _submit(update, sql, *args)
+
+
+def update_kw_async(table, where, *args, **kw):
+    '''
+    Same as update_kw but run on the db executor, return a Future.
+    '''
+    return _submit(update_kw, table, where, *args, **kw)
+
+
+def transaction_async(func, *args, **kw):
+    '''
+    Run func(*args, **kw) in a transaction on the db executor and return a Future of its result. The whole function
+    runs on one executor thread, so every statement inside uses the same connection:
+    def transfer(src, dst):
+        update('update account set balance=balance-1 where id=?', src)
+        update('update account set balance=balance+1 where id=?', dst)
+    yield transaction_async(transfer, 1, 2)
+    '''
+    return _submit(with_transaction(func), *args, **kw)
+
+
+def _init_pool(ping, pool_args):
+    '''
+    Replace the connection pool. pool_args are ConnectionPool arguments, max_size=0 disables pooling so every
+    connection context opens and closes its own connection.
+    '''
+    global _db_pool, _db_executor
+    old_pool, old_executor = _db_pool, _db_executor
+    if pool_args.get('max_size', 1) == 0:
+        _db_pool = None
+    else:
+        pool_args.setdefault('ping', ping)
+        _db_pool = ConnectionPool(lambda: _db_connect(), **pool_args)
+        _db_pool.warm_up()
+    # the executor is sized from the pool, create it again on first use.
+    _db_executor = None
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+    if old_pool is not None:
+        old_pool.close()
+
+
+def _pop_pool_args(kw):
+    return dict((k[len('pool_'):], kw.pop(k)) for k in kw.keys() if k.startswith('pool_'))
+
+
+def pool_stats():
+    '''
+    Return connection pool stats as Dict (see ConnectionPool.stats), or None if pooling is disabled.
+    '''
+    return None if _db_pool is None else _db_pool.stats()
+
+
+def init_connector(func_connect, convert_char='%s', ping=None, db_type=None, stream_cursor=None, integrity_error=None,
+                   **pool_args):
+    '''
+    Initialize database with a custom connect function.
+    Args:
+      func_connect: function returning a new DB-API connection.
+      convert_char: placeholder used by the driver.
+      ping: function(connection) checking a pooled connection on checkout, default to None.
+      db_type: SQL dialect for upsert, 'mysql' or 'sqlite3', default to None.
+      stream_cursor: cursor class used by select_iter, e.g. MySQLdb.cursors.SSCursor, default to None.
+      integrity_error: exception class of the driver raised as IntegrityError by writes, default to None.
+      **pool_args: ConnectionPool arguments, e.g. min_size=2, max_size=20.
+    '''
+    global _db_connect, _db_convert, _db_type, _db_stream_cursor, _db_integrity_errors
     _log('init connector...')
     _db_connect = func_connect
     _db_convert = convert_char
+    _db_type = db_type
+    _db_stream_cursor = stream_cursor
+    _db_integrity_errors = (integrity_error,) if integrity_error is not None else ()
+    _stmt_cache.clear()
+    _init_pool(ping, pool_args)
 
 
 def init(db_type, db_schema, db_host, db_port=0, db_user=None, db_password=None, db_driver=None, **db_args):
@@ -411,12 +848,16 @@ def init(db_type, db_schema, db_host, db_port=0, db_user=None, db_password=None,
       db_user: username.
       db_password: password.
       db_driver: db driver, default to None.
-      **db_args: other parameters, e.g. use_unicode=True
+      **db_args: other parameters, e.g. use_unicode=True. Arguments prefixed with pool_ configure the connection
+        pool, e.g. pool_min_size=2, pool_max_size=20, pool_idle_timeout=300, pool_recycle=3600, pool_timeout=10,
+        pool_ping=None, pool_ping_interval=30. pool_max_size=0 disables pooling.
     '''
-    global _db_connect, _db_convert
+    global _db_connect, _db_convert, _db_type, _db_stream_cursor, _db_integrity_errors
+    pool_args = _pop_pool_args(db_args)
     if db_type == 'mysql':
         _log('init mysql...')
         import MySQLdb
+        import MySQLdb.cursors
 
         if not 'use_unicode' in db_args:
             db_args['use_unicode'] = True
@@ -426,10 +867,23 @@ def init(db_type, db_schema, db_host, db_port=0, db_user=None, db_password=None,
             db_port = 3306
         _db_connect = lambda: MySQLdb.connect(db_host, db_user, db_password, db_schema, db_port, **db_args)
         _db_convert = '%s'
+        _db_stream_cursor = MySQLdb.cursors.SSCursor
+        _db_integrity_errors = (MySQLdb.IntegrityError,)
+        ping = lambda conn: conn.ping()
     elif db_type == 'sqlite3':
         _log('init sqlite3...')
         import sqlite3
 
-        _db_connect = lambda: sqlite3.connect(db_schema)
+        # pooled connections are handed between threads, but only used by one thread at a time.
+        # sqlite3 keeps prepared statements per connection, sized like our compiled statement cache.
+        _db_connect = lambda: sqlite3.connect(db_schema, check_same_thread=False,
+                                              cached_statements=_stmt_cache.max_size)
+        _db_convert = '?'
+        _db_stream_cursor = None
+        _db_integrity_errors = (sqlite3.IntegrityError,)
+        ping = None
     else:
-        raise DBError('Unsupported db: %s' % db_type)
\ No newline at end of file
+        raise DBError('Unsupported db: %s' % db_type)
+    _db_type = db_type
+    _stmt_cache.clear()
+    _init_pool(ping, pool_args)
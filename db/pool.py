@@ -0,0 +1,260 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+A bounded, thread-safe pool of DB-API connections used by dbutil.
+'''
+
+import time, threading
+from collections import deque
+from config import logger
+from utils import Dict
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeoutError(PoolError):
+    pass
+
+
+class _PooledConnection(object):
+    '''
+    Raw connection plus the bookkeeping the pool needs to decide whether it is still usable.
+    '''
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created = time.time()
+        self.last_used = self.created
+
+    def close(self):
+        try:
+            self.raw.close()
+        except Exception, e:
+            logger.warning('close pooled connection failed: %s', e)
+
+
+class ConnectionPool(object):
+    '''
+    Keeps between min_size and max_size connections open.
+
+    Args:
+      connect: function returning a new DB-API connection.
+      min_size: connections kept open even when idle, opened by warm_up().
+      max_size: hard limit of open connections, checkout blocks when reached.
+      idle_timeout: seconds an idle connection above min_size is kept, 0 to keep forever.
+      recycle: seconds after which a connection is closed and re-opened, 0 to disable.
+      timeout: seconds checkout blocks waiting for a free connection, None to wait forever.
+      ping: function(raw) checking a connection on checkout, None to skip.
+      ping_interval: seconds a connection may stay idle and be checked out without a ping, 0 to ping every checkout.
+
+    p = ConnectionPool(lambda: sqlite3.connect(':memory:'), max_size=2)
+    c = p.acquire()
+    p.release(c)
+    p.stats().idle
+    1
+    '''
+
+    def __init__(self, connect, min_size=1, max_size=10, idle_timeout=300, recycle=3600, timeout=10, ping=None,
+                 ping_interval=30):
+        if max_size < 1 or min_size > max_size:
+            raise PoolError('Invalid pool size: min_size=%s, max_size=%s' % (min_size, max_size))
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.recycle = recycle
+        self.timeout = timeout
+        self._ping = ping
+        self.ping_interval = ping_interval
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        # stats
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+
+    def _open(self):
+        conn = _PooledConnection(self._connect())
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _discard(self, conn):
+        '''
+        Close a connection that already left the idle list and free its slot.
+        '''
+        conn.close()
+        with self._cond:
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    def _expired(self, conn, now):
+        return self.recycle and now - conn.created > self.recycle
+
+    def _reap_idle(self, now):
+        '''
+        Remove idle connections above min_size that were unused longer than idle_timeout. Called with lock held,
+        returns the connections to close outside the lock.
+        '''
+        reaped = []
+        if not self.idle_timeout:
+            return reaped
+        # the idle list is used LIFO, so the longest idle connections are on the left.
+        while self._idle and self._size > self.min_size and now - self._idle[0].last_used > self.idle_timeout:
+            reaped.append(self._idle.popleft())
+            self._size -= 1
+            self._discarded += 1
+        return reaped
+
+    def warm_up(self):
+        '''
+        Open connections until min_size is reached. Errors are logged, connections will be opened lazily instead.
+        '''
+        opened = 0
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    break
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception, e:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                logger.warning('warm up connection pool failed: %s', e)
+                break
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+            opened += 1
+        logger.info('connection pool warmed up, %s connections opened.', opened)
+        return opened
+
+    def acquire(self, timeout=None):
+        '''
+        Check out a connection, blocking up to timeout (default to self.timeout) seconds when the pool is exhausted.
+
+        PoolTimeoutError: no connection became free in time.
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        while True:
+            conn, reaped = self._checkout(timeout)
+            for c in reaped:
+                c.close()
+            if conn is None:
+                # a free slot was reserved for us.
+                try:
+                    conn = self._open()
+                except:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                return conn
+            now = time.time()
+            if self._expired(conn, now):
+                self._discard(conn)
+                continue
+            # a connection used a moment ago is alive, a ping would only cost a round trip.
+            if self._ping and now - conn.last_used >= self.ping_interval:
+                try:
+                    self._ping(conn.raw)
+                except Exception, e:
+                    logger.warning('ping pooled connection failed, reconnect: %s', e)
+                    self._discard(conn)
+                    continue
+            return conn
+
+    def _checkout(self, timeout):
+        '''
+        Return (idle connection or None when a new slot was reserved, connections to close).
+        '''
+        with self._cond:
+            if self._closed:
+                raise PoolError('Connection pool is closed.')
+            reaped = self._reap_idle(time.time())
+            if self._idle:
+                return self._idle.pop(), reaped
+            if self._size < self.max_size:
+                self._size += 1
+                return None, reaped
+            self._waits += 1
+            start = time.time()
+            deadline = None if timeout is None else start + timeout
+            try:
+                while not self._idle and self._size >= self.max_size:
+                    if self._closed:
+                        raise PoolError('Connection pool is closed.')
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise PoolTimeoutError('No free connection after %s seconds (max_size=%s).' %
+                                                   (timeout, self.max_size))
+                        self._cond.wait(remaining)
+            finally:
+                self._wait_time += time.time() - start
+            if self._idle:
+                return self._idle.pop(), reaped
+            self._size += 1
+            return None, reaped
+
+    def release(self, conn, reset=True):
+        '''
+        Give a connection back. With reset, any open transaction is rolled back first, so the next borrower does not
+        see a stale snapshot; pass reset=False when the borrower ended its transaction. Connections that fail the
+        rollback, are expired or belong to a closed pool are closed.
+        '''
+        if reset:
+            try:
+                conn.raw.rollback()
+            except Exception, e:
+                logger.warning('reset pooled connection failed, discard it: %s', e)
+                self._discard(conn)
+                return
+        now = time.time()
+        if self._expired(conn, now):
+            self._discard(conn)
+            return
+        conn.last_used = now
+        with self._cond:
+            if not self._closed:
+                self._idle.append(conn)
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    def close(self):
+        '''
+        Close idle connections. Connections still checked out are closed when released.
+        '''
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        '''
+        Return a Dict snapshot: size, in_use, idle, max_size, waits, wait_time, timeouts, created, discarded.
+        '''
+        with self._cond:
+            return Dict(size=self._size, in_use=self._size - len(self._idle), idle=len(self._idle),
+                        min_size=self.min_size, max_size=self.max_size, waits=self._waits,
+                        wait_time=self._wait_time, timeouts=self._timeouts, created=self._created,
+                        discarded=self._discarded)
@@ -0,0 +1,182 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Read-through cache of select results, invalidated by table.
+
+Every table has a generation counter that is part of the cache key of the queries tagged with it. A write bumps the
+generations of the tables it touches, so older entries can never be read again and simply age out. With a Redis
+client and channel, the bumps are also published to, and received from, the other worker processes.
+
+Entries are kept in process only: the generations live in process memory and start at 0, so a worker started after
+writes of other processes would compute the keys of their stale entries in a shared store.
+'''
+
+import re, time, uuid, threading, hashlib
+from config import logger
+from utils import Dict, LRUCache
+from redis.exceptions import RedisError
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+key_prefix = "websetup_query"  # 缓存key前缀
+
+_RE_READ_TABLES = re.compile(r'\b(?:from|join)\s+`?(\w+)', re.I)
+_RE_WRITE_TABLE = re.compile(r'^\s*(?:update(?:\s+ignore)?|insert(?:\s+ignore)?\s+into|replace\s+into|delete\s+from)'
+                             r'\s+`?(\w+)', re.I)
+
+
+def read_tables(sql):
+    '''
+    Return the tables a select reads, as found after from / join.
+    > read_tables('select * from user u join user_role r on u.pid=r.pid')
+    ('user', 'user_role')
+    '''
+    return tuple(sorted(set([t.lower() for t in _RE_READ_TABLES.findall(sql)])))
+
+
+def written_table(sql):
+    '''
+    Return the table an insert / update / replace / delete writes, or None if it can not be found.
+    > written_table('update user set age=? where pid=?')
+    'user'
+    '''
+    m = _RE_WRITE_TABLE.match(sql)
+    return m.group(1).lower() if m else None
+
+
+class LocalBackend(object):
+    '''
+    In-process LRU of the cached results, with per-key TTL.
+    '''
+
+    def __init__(self, max_size=10000):
+        self._cache = LRUCache(max_size)
+
+    def get(self, key, default=None):
+        entry = self._cache.get(key)
+        if entry is None:
+            return default
+        if entry[0] < time.time():
+            self._cache.delete(key)
+            return default
+        return entry[1]
+
+    def set(self, key, value, expires):
+        self._cache.set(key, (time.time() + expires, value))
+
+
+def _copy(result):
+    # Dict rows are mutable, never hand out the cached objects themselves.
+    if isinstance(result, list):
+        return [_copy(r) for r in result]
+    if isinstance(result, dict):
+        return Dict(result.keys(), result.values())
+    return result
+
+
+class QueryCache(object):
+    '''
+    Args:
+      max_size: number of cached results kept in process.
+      client: redis.Redis publishing our invalidations on channel and receiving those of other processes.
+      channel: Redis pub/sub channel of the invalidations, None to invalidate in this process only.
+
+    Without client and channel only writes made by this process invalidate entries, other processes may read
+    entries up to their TTL old.
+    '''
+
+    def __init__(self, max_size=10000, client=None, channel=None):
+        self._backend = LocalBackend(max_size)
+        self._generations = {}
+        self._global_generation = 0
+        self._lock = threading.Lock()
+        self._client = client if channel else None
+        self.channel = channel
+        self._origin = uuid.uuid4().hex
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def _key(self, sql, first, args, tags):
+        gens = [self._generations.get(t, 0) for t in tags]
+        raw = pickle.dumps((sql, first, args, tags, gens, self._global_generation), 2)
+        return '%s_%s' % (key_prefix, hashlib.sha1(raw).hexdigest())
+
+    def get_or_load(self, sql, first, args, tags, ttl, load):
+        '''
+        Return the cached result of the query, or load() it and cache it for ttl seconds.
+        '''
+        if tags is None:
+            tags = read_tables(sql)
+        # the key is taken before loading, a write racing with the load bumps a generation and orphans our entry.
+        key = self._key(sql, first, args, tuple([t.lower() for t in tags]))
+        entry = self._backend.get(key)
+        if isinstance(entry, tuple):
+            self.hits += 1
+            return _copy(entry[0])
+        self.misses += 1
+        result = load()
+        # wrapped in a tuple, so a cached "no row" can be told apart from a miss.
+        self._backend.set(key, (result,), ttl)
+        self.stores += 1
+        return _copy(result)
+
+    def invalidate(self, tables=None):
+        '''
+        Invalidate cached queries of tables, or all cached queries if tables is None, in every process.
+        '''
+        self._bump(tables)
+        if self._client is not None:
+            message = '%s\x01%s' % (self._origin, '*' if tables is None else ','.join(tables))
+            try:
+                self._client.publish(self.channel, message)
+            except RedisError, e:
+                logger.error("publish query cache invalidation 失败: %s", e, exc_info=True)
+
+    def _bump(self, tables):
+        with self._lock:
+            if tables is None:
+                self._global_generation += 1
+            else:
+                for t in tables:
+                    t = t.lower()
+                    self._generations[t] = self._generations.get(t, 0) + 1
+            self.invalidations += 1
+
+    def _apply(self, message):
+        origin, tables = message.split('\x01', 1)
+        if origin != self._origin:
+            self._bump(None if tables == '*' else tables.split(','))
+
+    def listen(self):
+        '''
+        Apply the invalidations other processes publish on self.channel, in a daemon thread.
+        '''
+        if self._client is None:
+            return
+        t = threading.Thread(target=self._listen, name='query-cache-invalidation')
+        t.daemon = True
+        t.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # invalidations sent while we were not subscribed are lost, start over.
+                self._bump(None)
+                for msg in pubsub.listen():
+                    if msg['type'] == 'message':
+                        self._apply(msg['data'])
+            except RedisError, e:
+                logger.warning('订阅查询缓存失效消息失败: %s', e)
+                self._bump(None)
+                time.sleep(1)
+
+    def stats(self):
+        return Dict(hits=self.hits, misses=self.misses, stores=self.stores, invalidations=self.invalidations)
@@ -0,0 +1,116 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Compact, read-only result rows. A row class is generated once per column tuple and each row only keeps the values
+tuple returned by the driver, instead of a dict per row.
+'''
+
+from utils import Dict, LRUCache
+
+
+class Row(object):
+    '''
+    Base class of generated row classes. Supports row.col, row['col'] and the read-only dict methods.
+    > R = row_class(('id', 'name'))
+    > r = R((1, 'Bob'))
+    > r.name
+    'Bob'
+    > r['id']
+    1
+    > json.dumps(r, default=json_default)
+    '{"id": 1, "name": "Bob"}'
+    '''
+    __slots__ = ('_values',)
+    _names = ()
+    _index = {}
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getattr__(self, key):
+        try:
+            return self._values[self._index[key]]
+        except KeyError:
+            raise AttributeError(r"'Row' object has no attribute '%s'" % key)
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else self._values[i]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def keys(self):
+        return list(self._names)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._names, self._values)
+
+    def iteritems(self):
+        return iter(zip(self._names, self._values))
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            return self._names == other._names and self._values == other._values
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        r = self.__eq__(other)
+        return r if r is NotImplemented else not r
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # generated classes can not be found by name, pickle through the column tuple instead.
+        return make_row, (self._names, tuple(self._values))
+
+    def __repr__(self):
+        return 'Row(%s)' % ', '.join(['%s=%r' % (k, v) for k, v in zip(self._names, self._values)])
+
+    def to_dict(self):
+        return Dict(self._names, self._values)
+
+
+_row_classes = LRUCache(256)
+
+
+def row_class(names):
+    '''
+    Return the row class for a column tuple, generated on first use.
+    '''
+    names = tuple(names)
+    cls = _row_classes.get(names)
+    if cls is None:
+        cls = type('Row', (Row,), {'__slots__': (), '_names': names,
+                                   '_index': dict((n, i) for i, n in enumerate(names))})
+        _row_classes.set(names, cls)
+    return cls
+
+
+def make_row(names, values):
+    return row_class(names)(values)
+
+
+def json_default(o):
+    '''
+    default function for json.dumps, serializes rows as objects:
+    json.dumps({"status": 0, "data": row}, default=json_default)
+    '''
+    if isinstance(o, Row):
+        return o.to_dict()
+    raise TypeError(repr(o) + ' is not JSON serializable')
@@ -1,9 +1,107 @@
 # coding:utf-8
 __author__ = 'chenghao'
 
+import json
+import math
+import random
+from tornado import gen
 from tornado.web import RequestHandler
+from config import logger, request_timing_param
+from session import sessions
+from ratelimit import limiter
+import metrics
 
 
 class BaseHandler(RequestHandler):
+    in_flight = 0  # 正在处理的请求数, 优雅停止时等待其归零
+
+    def _execute(self, transforms, *args, **kwargs):
+        # 请求的所有回调中metrics.current()都是本请求的计时, 等待数据库、redis等的时间计入其中
+        self._timing = metrics.RequestTiming()
+        with metrics.activate(self._timing):
+            return super(BaseHandler, self)._execute(transforms, *args, **kwargs)
+
+    def prepare(self):
+        BaseHandler.in_flight += 1
+        self._counted = True
+
+    def finish(self, chunk=None):
+        timing = getattr(self, '_timing', None)
+        if timing is not None and request_timing_param["server_timing"] and not self._headers_written:
+            self.set_header("Server-Timing", self._server_timing(timing))
+        return super(BaseHandler, self).finish(chunk)
+
+    def _server_timing(self, timing):
+        """Server-Timing头: 各部分及其余(app)的毫秒数"""
+        parts = timing.parts()
+        total = self.request.request_time()
+        items = ["%s;dur=%.1f" % (k, v * 1000) for k, v in sorted(parts.items())]
+        items.append("app;dur=%.1f" % (max(0.0, total - sum(parts.values())) * 1000))
+        items.append("total;dur=%.1f" % (total * 1000))
+        return ", ".join(items)
+
+    def on_finish(self):
+        if getattr(self, '_counted', False):
+            self._counted = False
+            BaseHandler.in_flight -= 1
+        timing = getattr(self, '_timing', None)
+        if timing is None:
+            return
+        elapsed = self.request.request_time()
+        parts = timing.parts()
+        handler = type(self).__name__
+        metrics.registry.request(handler, self.request.method, self.get_status(), elapsed, parts)
+
+        # 慢请求全部记录, 其余抽样记录
+        slow = request_timing_param["slow_threshold"]
+        if slow is not None and elapsed > slow:
+            log = logger.warning
+        elif request_timing_param["sample_rate"] and random.random() < request_timing_param["sample_rate"]:
+            log = logger.info
+        else:
+            return
+        log("[REQUEST] " + json.dumps({
+            "handler": handler, "method": self.request.method, "path": self.request.path,
+            "status": self.get_status(), "ms": round(elapsed * 1000, 2),
+            "parts": dict((k, round(v * 1000, 2)) for k, v in parts.iteritems())}, sort_keys=True))
+
     def get(self, *args, **kwargs):
-        pass
\ No newline at end of file
+        pass
+
+    @gen.coroutine
+    def get_session(self):
+        """当前会话的数据, 没有会话或已过期时为None. 每个请求只读取一次redis, 并顺延会话的过期时间"""
+        if not hasattr(self, '_session'):
+            self._session_id = self.get_secure_cookie(sessions.cookie)
+            self._session = (yield sessions.load(self._session_id)) if self._session_id else None
+        raise gen.Return(self._session)
+
+    @gen.coroutine
+    def new_session(self, data):
+        """创建会话并写入签名的会话id cookie, redis出错未能保存时不写cookie, 返回None"""
+        self._session_id = yield sessions.create(data)
+        if self._session_id is None:
+            self._session = None
+            raise gen.Return(None)
+        self._session = data
+        self.set_secure_cookie(sessions.cookie, self._session_id, expires_days=None, httponly=True)
+        raise gen.Return(self._session_id)
+
+    @gen.coroutine
+    def clear_session(self):
+        """删除当前会话及其cookie"""
+        sid = self._session_id if hasattr(self, '_session_id') else self.get_secure_cookie(sessions.cookie)
+        if sid:
+            yield sessions.destroy(sid)
+        self._session_id = self._session = None
+        self.clear_cookie(sessions.cookie)
+
+    @gen.coroutine
+    def limit_rate(self, rule, **values):
+        """按config.rate_limits[rule]及客户端ip(反向代理后见config.app_profiles的xheaders)限流, 超限时返回429并结束请求. 返回是否可以继续处理"""
+        allowed, retry_after = yield limiter.check(rule, ip=self.request.remote_ip, **values)
+        if not allowed:
+            self.set_status(429, "Too Many Requests")
+            self.set_header("Retry-After", int(math.ceil(retry_after)))
+            self.finish(json.dumps({"status": -3}))
+        raise gen.Return(allowed)
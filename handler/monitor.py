@@ -0,0 +1,50 @@
+# coding:utf-8
+__author__ = 'chenghao'
+import os
+from base import BaseHandler
+import config
+from db import dbutil
+import metrics
+import cache
+import captcha
+from session import sessions
+from ratelimit import limiter
+
+"""Prometheus指标. 各进程分别统计, 多进程时每次抓取落在任一进程上, 所以每个指标都带pid标签"""
+
+
+def _gauges(name, stats, labels=""):
+    # 把stats()返回的Dict中的数值逐项输出为gauge
+    lines = []
+    if stats is None:
+        return lines
+    for k in sorted(stats):
+        v = stats[k]
+        if isinstance(v, (int, long, float)) and not isinstance(v, bool):
+            lines.append("websetup_%s_%s%s %r" % (name, k, "{%s}" % labels if labels else "", v))
+    return lines
+
+
+class Metrics(BaseHandler):
+    def get(self, *args, **kwargs):
+        pid = 'pid="%d"' % os.getpid()
+        lines = []
+        lines += _gauges("db_pool", dbutil.pool_stats(), pid)
+        lines += _gauges("db_statement_cache", dbutil.statement_cache_stats(), pid)
+        lines += _gauges("query_cache", dbutil.query_cache_stats(), pid)
+        lines += _gauges("redis_local_cache", cache.redis_cache.local_stats(), pid)
+        lines += _gauges("session", sessions.stats(), pid)
+        lines += _gauges("captcha_pool", captcha.pool_stats(), pid)
+        lines += _gauges("captcha_render_pool", captcha.render_pool_stats(), pid)
+        if config.logQueueHandler is not None:
+            lines += _gauges("log", config.logQueueHandler.stats(), pid)
+        for rule, stats in sorted(limiter.stats().items()):
+            lines += _gauges("rate_limit", stats, '%s,rule="%s"' % (pid, metrics.escape(rule)))
+
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(metrics.registry.prometheus(pid) + "\n".join(lines) + "\n")
+
+
+urls = [
+    (config.url_prefix + "/metrics", Metrics),  # 统计指标
+]
@@ -1,52 +1,84 @@
 # coding:utf-8
 __author__ = 'chenghao'
 
+from tornado import gen
 from base import BaseHandler
 import config
 from db import dbutil
+from db.rows import json_default
 import json
-from cache import redis_cache
-import cache
+from passwords import hasher
+import bloom
 
 
 class Login(BaseHandler):
     def get(self, *args, **kwargs):
         self.render("user/login.html")
 
+    @gen.coroutine
     def post(self, *args, **kwargs):
         args = self.request.arguments
         params = {}
         for i in args:
             params[i] = self.get_argument(i)
 
-        user = dbutil.select_one("""select pid, userName, loginName, loginPwd, age from user where loginName=? and
-                                 loginPwd=?""", params["loginName"], params["loginPwd"])
-        if user:
-            redis_cache.set(cache.user_session_prefix + "_" + params["loginName"], user)
-            re = {"status": 0, "data": user}
+        # 超限时直接返回429, 不查询数据库
+        if not (yield self.limit_rate("login", loginName=params.get("loginName"))):
+            return
+
+        user = yield dbutil.select_one_async("""select pid, userName, loginName, loginPwd, age from user where
+                                             loginName=?""", params["loginName"],
+                                             cache_ttl=config.query_cache_ttl, tags=("user",))
+        # 在线程池中校验密码, 不阻塞IOLoop
+        matches, needs_rehash = yield hasher.verify_async(params["loginPwd"], user["loginPwd"] if user else None)
+        if matches:
+            if needs_rehash:
+                # 明文密码或哈希参数已修改, 按当前参数重新哈希
+                pwd = yield hasher.hash_async(params["loginPwd"])
+                yield dbutil.update_kw_async("user", "pid=?", user["pid"], loginPwd=pwd)
+            data = dict((k, v) for k, v in user.items() if k != "loginPwd")
+            if (yield self.new_session(data)) is None:
+                # 会话未能保存
+                re = {"status": -1}
+            else:
+                re = {"status": 0, "data": data}
         else:
             re = {"status": -2}
 
-        self.finish(json.dumps(re))
+        self.finish(json.dumps(re, default=json_default))
 
 
 class Register(BaseHandler):
     def get(self, *args, **kwargs):
         self.render("user/register.html")
 
+    @gen.coroutine
     def post(self, *args, **kwargs):
         args = self.request.arguments
         params = {}
         for i in args:
             params[i] = self.get_argument(i)
 
-        item = dbutil.select_one("select loginName from user where loginName=?", params["loginName"])
+        names = bloom.login_names
+        if names is not None and not (yield names.contains(params["loginName"])):
+            # 过滤器中没有的登录名一定不存在, 不再查询, 直接插入
+            item = None
+        else:
+            item = yield dbutil.select_one_async("select loginName from user where loginName=?", params["loginName"])
         if item is None:
-            row = dbutil.insert("user", **params)
-            if row:
-                re = {"status": 0}
+            params["loginPwd"] = yield hasher.hash_async(params["loginPwd"])
+            try:
+                row = yield dbutil.insert_async("user", **params)
+            except dbutil.IntegrityError:
+                # 唯一索引冲突: 同时注册, 或其他进程新增的登录名还不在本进程的过滤器中
+                re = {"status": -2}
             else:
-                re = {"status": -1}
+                if row:
+                    if names is not None:
+                        names.add(params["loginName"])
+                    re = {"status": 0}
+                else:
+                    re = {"status": -1}
         else:
             re = {"status": -2}
 
@@ -1,69 +1,27 @@
 # coding:utf-8
 __author__ = 'chenghao'
-import random
-import string
-import StringIO
-from PIL import Image, ImageDraw, ImageFont
+from tornado import gen
 from base import BaseHandler
 import config
 import cache
+import captcha
 
 """随机验证码"""
 
 
 class VerCode(BaseHandler):
+    @gen.coroutine
     def get(self, *args, **kwargs):
         imei = self.get_argument("imei")  # 手机设备的唯一标识
 
-        img_size = (90, 40)  # 图片大小
-        width, height = img_size  # 长，宽
-        # 颜色值，图片大小，背景颜色
-        im = Image.new('RGBA', img_size, (255, 255, 255))
-        # 随机获取4位数
-        rule = string.letters + string.digits
-        texts = random.sample(rule, 4)
+        # 超限时直接返回429, 不生成验证码
+        if not (yield self.limit_rate("verCode", imei=imei)):
+            return
 
-        charset = "".join(texts)
+        # 从验证码池中取出4位数及其图片, 池空时在子进程中生成
+        charset, img_data = yield captcha.take_async()
 
-        cache.redis_cache.set(cache.ver_code_prefix + imei, charset)
-
-        # 创建画布
-        draw = ImageDraw.Draw(im)
-        # 设置字体大小
-        font_type = config.font_type
-        font_type = font_type.replace("\\", "/")
-        font = ImageFont.truetype(font_type, 40)
-
-        # 增加干扰线
-        for i in xrange(200):
-            x1 = random.randint(0, width)
-            y1 = random.randint(0, height)
-            x2 = random.randint(0, width)
-            y2 = random.randint(0, height)
-            # 干扰线颜色
-            fill = (random.randint(130, 250), random.randint(130, 250), random.randint(130, 250))
-            draw.line(((x1, y1), (x2, y2)), fill=fill)
-
-        x = 5
-        y = 2
-        for word in texts:
-            # 字体颜色
-            fill = (random.randint(0, 130), random.randint(0, 130), random.randint(0, 130))
-            draw.text((x, y), word, font=font, fill=fill)
-            x += 20
-
-        # 增加像素点
-        for i in xrange(1000):
-            x1 = random.randint(0, width - 1)
-            y1 = random.randint(0, height - 1)
-            # 像素点颜色
-            fill = (random.randint(20, 250), random.randint(20, 250), random.randint(20, 250))
-            im.putpixel((x1, y1), fill)
-
-        mem = StringIO.StringIO()
-        im.save(mem, "JPEG")
-        img_data = mem.getvalue()
-        mem.close()
+        yield cache.async_redis_cache.set(cache.ver_code_prefix + imei, charset)
 
         self.set_header('Content-Type', 'image/jpeg; charset=utf-8')
         self.finish(img_data)
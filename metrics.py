@@ -0,0 +1,342 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+In-process metrics: latency histograms and counters, exported in the Prometheus text format by handler.monitor.
+
+SQL statements are grouped by fingerprint, the statement with its literals replaced by ? and its whitespace and case
+normalized, so that "select * from user where pid=3" and "select * from user where pid=4" are one series. The
+fingerprint of a statement string is cached, a recorded query costs a dict lookup, a bisect and a few additions.
+
+Requests are timed per handler. While a request runs its RequestTiming is the current one (kept in a thread local,
+switched by a StackContext as the IOLoop moves between requests), and the time it spends waiting on the database,
+Redis and other executors is added to it, so a slow request shows where its time went.
+'''
+
+import re
+import time
+import random
+import bisect
+import threading
+from tornado.stack_context import StackContext
+from config import logger, metrics_param
+from utils import Dict, LRUCache
+
+# upper bounds (seconds) of the latency buckets, the last bucket is +Inf.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_literals = re.compile(r"""'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*"|\b\d+(?:\.\d+)?\b|%s""")
+_in_lists = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_spaces = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    '''
+    Return sql with its literals and placeholders replaced by ?, lists of them folded, spaces collapsed, lowercased.
+    > fingerprint("SELECT * FROM user WHERE loginName='bob' and pid in (1, 2,3)")
+    'select * from user where loginname=? and pid in (?+)'
+    '''
+    sql = _literals.sub('?', sql)
+    sql = _in_lists.sub('(?+)', sql)
+    return _spaces.sub(' ', sql).strip().lower()
+
+
+class Histogram(object):
+    '''
+    Counts of observed values per bucket of fixed upper bounds, with their sum. Quantiles are estimated by linear
+    interpolation inside the bucket they fall in, like Prometheus' histogram_quantile.
+    > h = Histogram()
+    > h.observe(0.003)
+    > h.quantile(0.5)
+    0.003
+    '''
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.max
+                lower = self.bounds[i - 1] if i else 0.0
+                return min(lower + (self.bounds[i] - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def cumulative(self):
+        '''
+        Return [(upper bound, count of values <= it)], ending with ('+Inf', count).
+        '''
+        r = []
+        total = 0
+        for bound, n in zip(self.bounds, self.counts):
+            total += n
+            r.append((bound, total))
+        r.append(('+Inf', self.count))
+        return r
+
+
+class QueryStats(object):
+    __slots__ = ('calls', 'errors', 'rows', 'latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.latency = Histogram()
+
+
+class RequestStats(object):
+    __slots__ = ('calls', 'errors', 'latency', 'parts')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+        self.parts = {}
+
+
+class RequestTiming(object):
+    '''
+    Time of one request spent in parts (db, redis, ...). Parts are added from executor threads too, list.append
+    needs no lock. Parts waited on at once (e.g. two queries yielded together) each count in full.
+    '''
+
+    __slots__ = ('start', 'spans')
+
+    def __init__(self):
+        self.start = time.time()
+        self.spans = []
+
+    def add(self, part, seconds):
+        self.spans.append((part, seconds))
+
+    def parts(self):
+        '''
+        Return {part: seconds}.
+        '''
+        r = {}
+        for part, seconds in self.spans:
+            r[part] = r.get(part, 0.0) + seconds
+        return r
+
+
+_local = threading.local()
+
+
+class _Activate(object):
+    # context manager making timing the current one, re-entered by the StackContext for every callback of the request.
+    __slots__ = ('timing', 'previous')
+
+    def __init__(self, timing):
+        self.timing = timing
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'timing', None)
+        _local.timing = self.timing
+
+    def __exit__(self, *exc_info):
+        _local.timing = self.previous
+
+
+def activate(timing):
+    '''
+    Return a StackContext making timing current in the callbacks run inside it.
+    with activate(RequestTiming()):
+        pass
+    '''
+    return StackContext(lambda: _Activate(timing))
+
+
+def current():
+    '''
+    Return the RequestTiming of the request running on this thread, None outside requests and on executor threads.
+    '''
+    return getattr(_local, 'timing', None)
+
+
+def attribute(part, future, start):
+    '''
+    Add the time from start until future is done to part of the current request, if any. Call it on the thread
+    that submitted the work, right after submitting. Returns future.
+    '''
+    timing = getattr(_local, 'timing', None)
+    if timing is not None:
+        future.add_done_callback(lambda f: timing.add(part, time.time() - start))
+    return future
+
+
+class Registry(object):
+    '''
+    Per-fingerprint query metrics and per-handler request metrics.
+    Args:
+      slow_threshold: seconds above which a statement is logged as WARNING, None to log none.
+      sample_rate: fraction of the other statements logged as INFO, 0 to log none.
+      max_fingerprints: most distinct fingerprints kept, later ones are counted under "other".
+
+    registry.query("select * from user where pid=?", 0.0012, rows=1)
+    registry.query_stats()["select * from user where pid=?"].p99
+    '''
+
+    OTHER = 'other'
+
+    def __init__(self, slow_threshold=0.1, sample_rate=0.0, max_fingerprints=500):
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
+        self.max_fingerprints = max_fingerprints
+        self._fingerprints = LRUCache(max_fingerprints * 4)
+        self._queries = {}
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, sql):
+        fp = self._fingerprints.get(sql)
+        if fp is None:
+            fp = fingerprint(sql)
+            self._fingerprints.set(sql, fp)
+        return fp
+
+    def query(self, sql, elapsed, rows=None, error=False):
+        '''
+        Record one execution of sql, which took elapsed seconds and returned or changed rows rows.
+        '''
+        fp = self._fingerprint(sql)
+        with self._lock:
+            stats = self._queries.get(fp)
+            if stats is None:
+                if len(self._queries) >= self.max_fingerprints:
+                    fp = self.OTHER
+                stats = self._queries.setdefault(fp, QueryStats())
+            stats.calls += 1
+            if error:
+                stats.errors += 1
+            if rows > 0:
+                stats.rows += rows
+            stats.latency.observe(elapsed)
+        if self.slow_threshold is not None and elapsed > self.slow_threshold:
+            logger.warning('[SLOW] [DB] %s: %s [ROWS] %s', elapsed, sql, rows)
+        elif self.sample_rate and random.random() < self.sample_rate:
+            logger.info('[PROFILING] [DB] %s: %s [ROWS] %s', elapsed, sql, rows)
+
+    def query_stats(self):
+        '''
+        Return {fingerprint: Dict(calls, errors, rows, total, max, p50, p95, p99)}, latencies in seconds.
+        '''
+        with self._lock:
+            return dict((fp, Dict(calls=s.calls, errors=s.errors, rows=s.rows, total=s.latency.sum,
+                                  max=s.latency.max, p50=s.latency.quantile(0.5), p95=s.latency.quantile(0.95),
+                                  p99=s.latency.quantile(0.99)))
+                        for fp, s in self._queries.iteritems())
+
+    def request(self, handler, method, status, elapsed, parts):
+        '''
+        Record one request of handler, which took elapsed seconds, parts being {part: seconds} of it.
+        '''
+        with self._lock:
+            stats = self._requests.get((handler, method))
+            if stats is None:
+                stats = self._requests[(handler, method)] = RequestStats()
+            stats.calls += 1
+            if status >= 500:
+                stats.errors += 1
+            stats.latency.observe(elapsed)
+            for part, seconds in parts.iteritems():
+                stats.parts[part] = stats.parts.get(part, 0.0) + seconds
+
+    def request_stats(self):
+        '''
+        Return {(handler, method): Dict(calls, errors, total, max, p50, p95, p99, parts)}, parts being
+        {part: seconds in total}.
+        '''
+        with self._lock:
+            return dict((key, Dict(calls=s.calls, errors=s.errors, total=s.latency.sum, max=s.latency.max,
+                                   p50=s.latency.quantile(0.5), p95=s.latency.quantile(0.95),
+                                   p99=s.latency.quantile(0.99), parts=dict(s.parts)))
+                        for key, s in self._requests.iteritems())
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self._requests.clear()
+
+    def prometheus(self, labels=''):
+        '''
+        Return the registry in the Prometheus text exposition format, labels (e.g. 'pid="12"') added to every sample.
+        '''
+        prefix = labels + ',' if labels else ''
+        with self._lock:
+            queries = sorted((fp, s.calls, s.errors, s.rows, s.latency.cumulative(), s.latency.sum,
+                              [s.latency.quantile(q) for q in (0.5, 0.95, 0.99)])
+                             for fp, s in self._queries.iteritems())
+            requests = sorted((prefix + 'handler="%s",method="%s"' % (escape(h), m), s.calls, s.errors,
+                               s.latency.cumulative(), s.latency.sum, sorted(s.parts.items()))
+                              for (h, m), s in self._requests.iteritems())
+        lines = ['# HELP websetup_sql_duration_seconds SQL statement latency by fingerprint.',
+                 '# TYPE websetup_sql_duration_seconds histogram']
+        for fp, calls, errors, rows, buckets, total, quantiles in queries:
+            _histogram(lines, 'websetup_sql_duration_seconds', prefix + 'fingerprint="%s"' % escape(fp), buckets, total,
+                       calls)
+        lines += ['# HELP websetup_sql_duration_quantile_seconds SQL statement latency quantiles since start.',
+                  '# TYPE websetup_sql_duration_quantile_seconds gauge']
+        for fp, calls, errors, rows, buckets, total, quantiles in queries:
+            for q, v in zip(('0.5', '0.95', '0.99'), quantiles):
+                lines.append('websetup_sql_duration_quantile_seconds{%sfingerprint="%s",quantile="%s"} %r'
+                             % (prefix, escape(fp), q, v))
+        for name, index, text in (('errors', 2, 'SQL statements that raised'),
+                                  ('rows', 3, 'Rows returned or changed by SQL statements')):
+            lines += ['# HELP websetup_sql_%s_total %s, by fingerprint.' % (name, text),
+                      '# TYPE websetup_sql_%s_total counter' % name]
+            for q in queries:
+                lines.append('websetup_sql_%s_total{%sfingerprint="%s"} %d' % (name, prefix, escape(q[0]), q[index]))
+
+        lines += ['# HELP websetup_request_duration_seconds Request latency by handler.',
+                  '# TYPE websetup_request_duration_seconds histogram']
+        for label, calls, errors, buckets, total, parts in requests:
+            _histogram(lines, 'websetup_request_duration_seconds', label, buckets, total, calls)
+        lines += ['# HELP websetup_request_errors_total Requests answered with a 5xx status, by handler.',
+                  '# TYPE websetup_request_errors_total counter']
+        for label, calls, errors, buckets, total, parts in requests:
+            lines.append('websetup_request_errors_total{%s} %d' % (label, errors))
+        lines += ['# HELP websetup_request_part_seconds_total Request time spent waiting on db, redis, ..., by handler.',
+                  '# TYPE websetup_request_part_seconds_total counter']
+        for label, calls, errors, buckets, total, parts in requests:
+            for part, seconds in parts:
+                lines.append('websetup_request_part_seconds_total{%s,part="%s"} %r' % (label, escape(part), seconds))
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram(lines, name, label, buckets, total, count):
+    for bound, n in buckets:
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, label, bound, n))
+    lines.append('%s_sum{%s} %r' % (name, label, total))
+    lines.append('%s_count{%s} %d' % (name, label, count))
+
+
+def escape(value):
+    '''
+    Escape a Prometheus label value.
+    '''
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry(**metrics_param)
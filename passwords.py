@@ -0,0 +1,129 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Password hashing with PBKDF2-HMAC-SHA256. Hashes are stored as "pbkdf2_sha256$iterations$salt$hash" (salt and hash
+base64), so the work factor can be raised later: a login whose stored hash uses other parameters, or a plain text
+password of the old schema, is verified and then hashed again with the current ones.
+
+The KDF is CPU bound on purpose and must not run on the IOLoop thread. The OpenSSL hashlib.pbkdf2_hmac releases the
+GIL while it runs, so a thread pool spreads it over the cores; a process pool is available too. Without OpenSSL,
+hashlib falls back to a pure Python pbkdf2_hmac that holds the GIL and would stall the IOLoop from a thread, so the
+hasher then uses a process pool whatever the configuration says, and logs a warning.
+'''
+
+import os
+import hmac
+import base64
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from config import logger, password_param
+from utils import utf8
+import metrics
+
+ALGORITHM = 'pbkdf2_sha256'
+# False when hashlib has no OpenSSL pbkdf2_hmac and uses its pure Python fallback, which holds the GIL.
+NATIVE_KDF = hashlib.pbkdf2_hmac.__module__ != 'hashlib'
+
+
+def encode(password, salt, iterations):
+    '''
+    Return the stored form of password.
+    > encode('123456', 'c2FsdA==', 1000)
+    'pbkdf2_sha256$1000$c2FsdA==$...'
+    '''
+    dk = hashlib.pbkdf2_hmac('sha256', utf8(password), utf8(salt), iterations)
+    return '%s$%d$%s$%s' % (ALGORITHM, iterations, salt, base64.b64encode(dk))
+
+
+def make_hash(password, iterations, salt_size=16):
+    return encode(password, base64.b64encode(os.urandom(salt_size)), iterations)
+
+
+def check(password, stored, iterations):
+    '''
+    Return (matches, needs_rehash): whether password matches the stored form, and whether that form was made with
+    other parameters than iterations, or is a plain text password.
+    '''
+    password, stored = utf8(password), utf8(stored or '')
+    parts = stored.split('$')
+    if len(parts) != 4 or parts[0] != ALGORITHM:
+        # plain text password written before hashing was introduced.
+        return hmac.compare_digest(password, stored), True
+    try:
+        matches = hmac.compare_digest(encode(password, parts[2], int(parts[1])), stored)
+    except ValueError:
+        return False, False
+    return matches, int(parts[1]) != iterations
+
+
+class PasswordHasher(object):
+    '''
+    Args:
+      iterations: PBKDF2 work factor of new hashes.
+      max_workers: most hashes computed at once, further calls wait in the executor queue.
+      processes: compute in worker processes instead of threads, always the case without NATIVE_KDF.
+
+    stored = yield hasher.hash_async(password)
+    matches, needs_rehash = yield hasher.verify_async(password, stored)
+    '''
+
+    def __init__(self, iterations=100000, max_workers=4, processes=False):
+        self.iterations = iterations
+        self.max_workers = max_workers
+        self.processes = processes
+        if not processes and not NATIVE_KDF:
+            logger.warning('pbkdf2_hmac为纯Python实现, 计算时占用GIL, 改为在子进程中计算密码哈希')
+            self.processes = True
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    cls = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+                    self._executor = cls(max_workers=self.max_workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _submit(self, fn, *args):
+        start = time.time()
+        return metrics.attribute('password', self._get_executor().submit(fn, *args), start)
+
+    def hash(self, password):
+        return make_hash(password, self.iterations)
+
+    def verify(self, password, stored):
+        '''
+        Return (matches, needs_rehash), see check(). A missing stored hash never matches.
+        '''
+        if stored is None:
+            return _no_match(password, self.iterations)
+        return check(password, stored, self.iterations)
+
+    def hash_async(self, password):
+        '''
+        Same as hash, run on the executor, return a Future.
+        '''
+        return self._submit(make_hash, password, self.iterations)
+
+    def verify_async(self, password, stored):
+        '''
+        Same as verify, run on the executor, return a Future.
+        '''
+        if stored is None:
+            return self._submit(_no_match, password, self.iterations)
+        return self._submit(check, password, stored, self.iterations)
+
+
+def _no_match(password, iterations):
+    # a user that does not exist costs one KDF like a wrong password, so response times do not tell names apart.
+    encode(password, 'AAAAAAAAAAAAAAAAAAAAAA==', iterations)
+    return False, False
+
+
+hasher = PasswordHasher(**password_param)
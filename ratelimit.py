@@ -0,0 +1,111 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Token bucket rate limiting in Redis. A check takes one token from the bucket of every dimension of a rule (e.g. the
+client ip and the loginName of a login) in one atomic Lua script, so a request costs one round trip however many
+dimensions it is limited by, and workers share the buckets. A request is allowed only when every bucket has a token,
+and then takes one from each.
+
+A key Redis has refused is remembered in-process until its bucket refills, so that a client hammering an endpoint is
+turned away without reaching Redis again. If Redis fails, checks fail open.
+'''
+
+import time
+from tornado import gen
+from config import rate_limits, rate_limit_param
+from utils import Dict, LRUCache, utf8
+import cache
+
+# KEYS: one bucket per dimension. ARGV: now in ms, then rate (tokens per second) and burst of every bucket.
+# Returns {1, 0, 0} when allowed, or {0, index of the empty bucket (1-based), ms until it has a token}.
+TOKEN_BUCKET = """-- name: token_bucket
+local now = tonumber(ARGV[1])
+local tokens = {}
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local b = redis.call('HMGET', KEYS[i], 't', 'ts')
+    local t = tonumber(b[1])
+    if t == nil then
+        t = burst
+    else
+        t = math.min(burst, t + math.max(0, now - tonumber(b[2])) * rate / 1000)
+    end
+    if t < 1 then
+        return {0, i, math.ceil((1 - t) * 1000 / rate)}
+    end
+    tokens[i] = t
+end
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HMSET', KEYS[i], 't', tokens[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(burst * 1000 / rate))
+end
+return {1, 0, 0}
+"""
+
+
+class RateLimiter(object):
+    '''
+    Args:
+      client: AsyncRedisClient holding the buckets.
+      rules: {rule: {dimension: (rate, burst)}}, rate being tokens added per second and burst the bucket size.
+      prefilter_size: most refused keys remembered in-process.
+
+    allowed, retry_after = yield limiter.check("login", ip="10.0.0.1", loginName="bob")
+    '''
+
+    def __init__(self, client, rules, prefilter_size=10000):
+        self._client = client
+        self.rules = rules
+        self._blocked = LRUCache(prefilter_size)
+        self._counts = dict((name, Dict(allowed=0, limited=0, prefiltered=0, errors=0)) for name in rules)
+
+    def key(self, rule, dimension, value):
+        return '%s_%s_%s_%s' % (cache.rate_limit_prefix, rule, dimension, utf8(value))
+
+    @gen.coroutine
+    def check(self, rule, **values):
+        '''
+        Take a token for every dimension of rule given in values. Return (allowed, seconds until a retry may pass).
+        '''
+        counts = self._counts[rule]
+        limits = self.rules[rule]
+        dims = sorted(d for d in values if d in limits and values[d] is not None)
+        keys = [self.key(rule, d, values[d]) for d in dims]
+        now = time.time()
+        for k in keys:
+            until = self._blocked.get(k)
+            if until is not None and until > now:
+                counts.prefiltered += 1
+                raise gen.Return((False, until - now))
+        if not keys:
+            counts.allowed += 1
+            raise gen.Return((True, 0))
+
+        args = [int(now * 1000)]
+        for d in dims:
+            args.extend(limits[d])
+        r = yield self._client.run_script(TOKEN_BUCKET, keys, args)
+        if r == -1:
+            counts.errors += 1
+            raise gen.Return((True, 0))
+        allowed, index, retry_ms = r
+        if allowed:
+            counts.allowed += 1
+            raise gen.Return((True, 0))
+        counts.limited += 1
+        retry = retry_ms / 1000.0
+        self._blocked.set(keys[index - 1], now + retry)
+        raise gen.Return((False, retry))
+
+    def stats(self):
+        '''
+        Return {rule: Dict(allowed, limited, prefiltered, errors)}. errors are Redis failures, let through.
+        '''
+        return dict((name, Dict(**c)) for name, c in self._counts.iteritems())
+
+
+limiter = RateLimiter(cache.async_redis_cache, rate_limits, **rate_limit_param)
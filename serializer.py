@@ -0,0 +1,151 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Cache value serialization. Every payload starts with one format byte: the low nibble is the codec, the high nibble
+the compression. Payloads written before the header existed are plain pickles, whose first byte is a printable
+pickle opcode or '\\x80', so they are still read as pickle.
+'''
+
+import json
+import zlib
+from config import logger
+from utils import Dict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+# 编码格式
+CODEC_PICKLE = 0x01
+CODEC_JSON = 0x02
+CODEC_MSGPACK = 0x03
+# 压缩格式
+COMPRESS_ZLIB = 0x10
+COMPRESS_LZ4 = 0x20
+
+
+def _dict(d):
+    return Dict(d.keys(), d.values())
+
+
+def _json_default(o):
+    # compact rows and other mappings are stored as plain objects.
+    if hasattr(o, 'keys') and hasattr(o, 'values'):
+        return dict(zip(o.keys(), o.values()))
+    raise TypeError(repr(o) + ' is not JSON serializable')
+
+
+def _pickle_dumps(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _json_dumps(value):
+    return json.dumps(value, separators=(',', ':'), default=_json_default)
+
+
+def _json_loads(payload):
+    return json.loads(payload, object_hook=_dict)
+
+
+def _msgpack_dumps(value):
+    return msgpack.packb(value, use_bin_type=True, default=_json_default)
+
+
+def _msgpack_loads(payload):
+    return msgpack.unpackb(payload, raw=False, object_hook=_dict)
+
+
+_codecs = {
+    # name: (format byte, dumps, loads)
+    'pickle': (CODEC_PICKLE, _pickle_dumps, pickle.loads),
+    'json': (CODEC_JSON, _json_dumps, _json_loads),
+    'msgpack': (CODEC_MSGPACK, _msgpack_dumps, _msgpack_loads),
+}
+_loads = dict((v[0], v[2]) for v in _codecs.itervalues())
+
+_compressors = {
+    # name: (format bit, compress, decompress)
+    'zlib': (COMPRESS_ZLIB, lambda s, level: zlib.compress(s, level), zlib.decompress),
+    'lz4': (COMPRESS_LZ4, lambda s, level: lz4.compress(s, compression_level=level), lambda s: lz4.decompress(s)),
+}
+_decompress = dict((v[0], v[2]) for v in _compressors.itervalues())
+# every header byte we write; none of them is a pickle opcode.
+_headers = set([c | z for c in _loads for z in [0] + _decompress.keys()])
+
+
+class Serializer(object):
+    '''
+    Args:
+      codec: 'pickle' (highest protocol), 'json' or 'msgpack'. json and msgpack decode objects as utils.Dict and do
+        not keep tuples or non-string keys.
+      compress: 'zlib', 'lz4' or None.
+      compress_threshold: payloads of at least this many bytes are compressed, when that makes them smaller.
+      compress_level: compression level passed to the compressor.
+      legacy: write headerless default protocol pickles, readable by code older than this module. Use it for the
+        first step of a rolling deploy, until every reader understands the header.
+
+    s = Serializer('msgpack', 'zlib')
+    s.loads(s.dumps({'a': 1}))
+    {'a': 1}
+    '''
+
+    def __init__(self, codec='pickle', compress='zlib', compress_threshold=1024, compress_level=1, legacy=False):
+        if codec not in _codecs:
+            raise ValueError('Unsupported codec: %s' % codec)
+        if codec == 'msgpack' and msgpack is None:
+            raise ValueError('msgpack codec needs the msgpack package.')
+        if compress is not None and compress not in _compressors:
+            raise ValueError('Unsupported compression: %s' % compress)
+        if compress == 'lz4' and lz4 is None:
+            raise ValueError('lz4 compression needs the lz4 package.')
+        self.codec = codec
+        self.compress = compress
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.legacy = legacy
+        self._format, self._dumps = _codecs[codec][:2]
+        if compress is not None:
+            self._compress_bit, self._compress = _compressors[compress][:2]
+
+    def dumps(self, value):
+        if self.legacy:
+            return pickle.dumps(value)
+        payload = self._dumps(value)
+        header = self._format
+        if self.compress is not None and len(payload) >= self.compress_threshold:
+            compressed = self._compress(payload, self.compress_level)
+            if len(compressed) < len(payload):
+                payload = compressed
+                header |= self._compress_bit
+        return chr(header) + payload
+
+    def loads(self, payload):
+        '''
+        Decode a payload of any format, None if payload is None or can not be decoded.
+        '''
+        if payload is None:
+            return None
+        try:
+            header = ord(payload[0]) if payload else 0
+            if header not in _headers:
+                # no header: written by the old pickle.dumps.
+                return pickle.loads(payload)
+            payload = payload[1:]
+            if header & 0xf0:
+                payload = _decompress[header & 0xf0](payload)
+            return _loads[header & 0x0f](payload)
+        except Exception, e:
+            logger.warning('反序列化缓存失败: %s', e)
+            return None
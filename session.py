@@ -0,0 +1,122 @@
+# coding:utf-8
+__author__ = 'chenghao'
+
+'''
+Redis-backed sessions with sliding expiration. A session lives under cache.session_prefix + "_" + sid for expires
+seconds after its last use. Refreshing the TTL on every request would cost one EXPIRE per request, so the sessions
+used during a refresh window are collected and refreshed together at the end of it, in one pipelined batch: a busy
+session costs at most one EXPIRE per window, and expires at most one window later than it would otherwise.
+
+When Redis fails, create and load return None and count an error: no cookie is issued for a session that was not
+stored, and an outage does not look like a valid session.
+'''
+
+import uuid
+from tornado import gen
+from tornado.ioloop import IOLoop
+from config import session_param
+from utils import Dict
+import cache
+
+
+class SessionStore(object):
+    '''
+    Args:
+      client: AsyncRedisClient storing the sessions, its local tier (if any) serves repeated loads.
+      cookie: name of the signed cookie holding the session id.
+      expires: seconds a session lives after its last use.
+      refresh_window: seconds during which the TTL refreshes of the used sessions are coalesced.
+
+    sid = yield sessions.create({'pid': 1})
+    data = yield sessions.load(sid)
+    '''
+
+    def __init__(self, client, cookie="websetup_sid", expires=30 * 60, refresh_window=60):
+        self._client = client
+        self.cookie = cookie
+        self.expires = expires
+        self.refresh_window = refresh_window
+        self._pending = set()
+        self._timer = None
+        self.loads = 0
+        self.misses = 0
+        self.errors = 0
+        self.touches = 0
+        self.refreshes = 0
+        self.batches = 0
+
+    def key(self, sid):
+        return cache.session_prefix + "_" + sid
+
+    @gen.coroutine
+    def create(self, data):
+        '''
+        Store data under a new session id, return the id, or None if it could not be stored.
+        '''
+        sid = uuid.uuid4().hex
+        if (yield self._client.set(self.key(sid), data, self.expires)) == -1:
+            self.errors += 1
+            raise gen.Return(None)
+        raise gen.Return(sid)
+
+    @gen.coroutine
+    def load(self, sid):
+        '''
+        Return the data of session sid, None if it does not exist, has expired or could not be read.
+        '''
+        self.loads += 1
+        data = yield self._client.get(self.key(sid))
+        if data == -1:
+            # get returns -1 when redis fails.
+            self.errors += 1
+            data = None
+        elif data is None:
+            self.misses += 1
+        else:
+            self.touch(sid)
+        raise gen.Return(data)
+
+    def save(self, sid, data):
+        '''
+        Replace the data of session sid, which also restarts its TTL. Returns a Future.
+        '''
+        self._pending.discard(self.key(sid))
+        return self._client.set(self.key(sid), data, self.expires)
+
+    def destroy(self, sid):
+        '''
+        Delete session sid. Returns a Future.
+        '''
+        self._pending.discard(self.key(sid))
+        return self._client.delete(self.key(sid))
+
+    def touch(self, sid):
+        '''
+        Schedule a TTL refresh of session sid, sent with the others at the end of the current window.
+        '''
+        self.touches += 1
+        self._pending.add(self.key(sid))
+        if self._timer is None:
+            self._timer = IOLoop.current().call_later(self.refresh_window, self.flush)
+
+    def flush(self):
+        '''
+        Refresh the TTL of the sessions touched since the last flush now. Returns a Future, or None if there were
+        none.
+        '''
+        if self._timer is not None:
+            IOLoop.current().remove_timeout(self._timer)
+            self._timer = None
+        if not self._pending:
+            return None
+        keys, self._pending = list(self._pending), set()
+        self.refreshes += len(keys)
+        self.batches += 1
+        return self._client.expires(keys, self.expires)
+
+    def stats(self):
+        return Dict(loads=self.loads, misses=self.misses, errors=self.errors, touches=self.touches, refreshes=self.refreshes,
+                    batches=self.batches, pending=len(self._pending))
+
+
+sessions = SessionStore(cache.async_redis_cache, **session_param)
@@ -1,37 +1,220 @@
 # coding:utf-8
 __author__ = 'chenghao'
 
+import time
+
+started = time.time()  # 进程启动时间, 用于统计启动耗时
+
 import os
+import sys
+import base64
+import glob
+import errno
+import random
+import signal
+import logging
 import tornado.web
+import tornado.netutil
+import tornado.process
+import tornado.template
 import tornado.httpserver
 import tornado.ioloop
 from tornado.options import define, options
 from urls import handlers_urls
+from handler.base import BaseHandler
 from db import dbutil
-from config import mysql_param
+import cache
+import bloom
+from session import sessions
+from config import logger, app_profiles, cookie_secret, mysql_param, mysql_pool_param, query_cache_param
 
 define("port", default=7777, help="run on the given port", type=int)
+define("profile", default="dev", help="application profile: " + ", ".join(sorted(app_profiles)), type=str)
+define("workers", default=1, help="number of worker processes, 0 for one per cpu", type=int)
+define("drain_timeout", default=10, help="seconds to wait for in-flight requests on SIGTERM", type=float)
 
-# 禁用tornado的日志
-tornado.options.options.logging = "none"
-tornado.options.parse_command_line()
+# 没有配置cookie签名密钥时(非prod)使用, 仅本次启动有效. 导入时即fork子进程前生成, 各子进程一致
+run_cookie_secret = base64.b64encode(os.urandom(32))
+template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+static_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 
 
 class Application(tornado.web.Application):
-    def __init__(self):
+    def __init__(self, debug=True, template_loader=None, cookie_secret=cookie_secret):
         handlers = handlers_urls
 
         settings = dict(
-            template_path=os.path.join(os.path.dirname(__file__), "templates"),
-            static_path=os.path.join(os.path.dirname(__file__), "static"),
-            debug=True,
+            template_path=template_path,
+            static_path=static_path,
+            cookie_secret=cookie_secret,
+            debug=debug,
         )
+        if template_loader is not None:
+            settings["template_loader"] = template_loader
         tornado.web.Application.__init__(self, handlers, **settings)
 
-        dbutil.init("mysql", mysql_param["db"], mysql_param["host"], mysql_param["port"], mysql_param["user"],
-                    mysql_param["password"], mysql_param["password"])
+
+def compile_templates(patterns):
+    """预编译模板, 返回已编译模板的Loader"""
+    loader = tornado.template.Loader(template_path)
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(template_path, pattern))):
+            loader.load(os.path.relpath(path, template_path).replace(os.sep, "/"))
+    return loader
+
+
+def get_cookie_secret(profile, conf):
+    """运行配置conf使用的cookie签名密钥, 要求配置密钥(prod)而没有配置时抛出ValueError"""
+    if cookie_secret is not None:
+        return cookie_secret
+    if conf["require_cookie_secret"]:
+        raise ValueError("Profile %s needs a cookie secret: set WEBSETUP_COOKIE_SECRET or "
+                         "WEBSETUP_COOKIE_SECRET_FILE" % profile)
+    return run_cookie_secret
+
+
+def make_app(profile="dev", **overrides):
+    """
+    按运行配置创建Application, 不初始化数据库, 不监听端口.
+    overrides覆盖config.app_profiles中该配置的项, 如 make_app("prod", debug=True)
+    """
+    if profile not in app_profiles:
+        raise ValueError("Unknown profile: %s" % profile)
+    conf = dict(app_profiles[profile], **overrides)
+    logger.setLevel(getattr(logging, conf["log_level"]))
+
+    t = time.time()
+    loader = compile_templates(conf["precompile_templates"]) if conf["precompile_templates"] else None
+    app = Application(debug=conf["debug"], template_loader=loader, cookie_secret=get_cookie_secret(profile, conf))
+    app.profile = profile
+    app.xheaders = conf["xheaders"]
+    app.startup = dict(templates=time.time() - t, compiled=len(loader.templates) if loader else 0)
+    return app
+
+
+def init_worker(forked):
+    """初始化数据库连接池及redis连接池, 多进程时在每个子进程fork之后调用"""
+    if forked:
+        cache.after_fork()
+    dbutil.init("mysql", mysql_param["db"], mysql_param["host"], mysql_param["port"], mysql_param["user"],
+                mysql_param["password"], mysql_param["password"], **mysql_pool_param)
+    # 多进程时写表通过redis通知其他进程使查询缓存失效
+    dbutil.init_query_cache(client=cache.redis_cache.raw() if forked else None, **query_cache_param)
+    bloom.init_login_names()
+
+
+workers = {}  # 主进程中: 子进程pid -> 编号
+stopping = False  # 主进程已收到SIGTERM, 不再重启退出的子进程
+
+
+def fork_workers(num, max_restarts=100):
+    """
+    fork出num个子进程, 在子进程中返回其编号. 主进程记下各子进程的pid并等待, 异常退出的重新fork,
+    全部退出后主进程退出. 同tornado.process.fork_processes, 但停止时只通知这些子进程
+    """
+    def start_child(i):
+        pid = os.fork()
+        if pid == 0:
+            # 各子进程的随机数(验证码等)不同
+            random.seed()
+            workers.clear()
+            return i
+        workers[pid] = i
+        return None
+
+    for i in range(num):
+        if start_child(i) is not None:
+            return i
+    restarts = 0
+    while workers:
+        try:
+            pid, status = os.wait()
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        i = workers.pop(pid, None)
+        if i is None or stopping or (os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0):
+            continue
+        logger.warning('子进程%d(pid=%d)异常退出, 状态%d, 重新启动', i, pid, status)
+        restarts += 1
+        if restarts > max_restarts:
+            raise RuntimeError("Too many child restarts, giving up")
+        if start_child(i) is not None:
+            return i
+    sys.exit(0)
+
+
+def stop_workers(sig, frame):
+    """主进程收到SIGTERM时转发给各子进程(不含同一进程组中的其他进程), 子进程正常退出后主进程也随之退出"""
+    global stopping
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    stopping = True
+    for pid in workers.keys():
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+def drain(server):
+    """停止接收新连接, 等待正在处理的请求完成或超时后停止IOLoop"""
+    io_loop = tornado.ioloop.IOLoop.current()
+    deadline = time.time() + options.drain_timeout
+    server.stop()
+    # 不等到窗口结束, 立即续期本窗口内访问过的会话
+    sessions.flush()
+
+    def check():
+        if BaseHandler.in_flight <= 0 or time.time() >= deadline:
+            if BaseHandler.in_flight > 0:
+                logger.warning('停止时仍有%d个请求未完成', BaseHandler.in_flight)
+            io_loop.stop()
+        else:
+            io_loop.call_later(0.05, check)
+
+    check()
+
+
+def on_sigterm(server):
+    def handler(sig, frame):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        tornado.ioloop.IOLoop.current().add_callback_from_signal(drain, server)
+
+    return handler
+
+
+def main():
+    # 禁用tornado的日志
+    tornado.options.options.logging = "none"
+    tornado.options.parse_command_line()
+    imported = time.time()
+    if options.profile in app_profiles:
+        # fork子进程前检查, 否则每个子进程都启动失败并被不断重启
+        get_cookie_secret(options.profile, app_profiles[options.profile])
+
+    # 只绑定一次端口, 各子进程共用
+    sockets = tornado.netutil.bind_sockets(options.port)
+    forked = options.workers != 1
+    if forked:
+        signal.signal(signal.SIGTERM, stop_workers)
+        # 子进程异常退出时自动重启
+        fork_workers(options.workers or tornado.process.cpu_count())
+    forked_at = time.time()
+
+    # 多进程时不能自动重载代码
+    app = make_app(options.profile, **({"debug": False} if forked else {}))
+    init_worker(forked)
+    http_server = tornado.httpserver.HTTPServer(app, xheaders=app.xheaders)
+    http_server.add_sockets(sockets)
+    signal.signal(signal.SIGTERM, on_sigterm(http_server))
+
+    now = time.time()
+    logger.warning('启动完成: profile=%s pid=%d 导入%.3fs 编译模板%d个%.3fs 初始化%.3fs 共%.3fs',
+                   options.profile, os.getpid(), imported - started, app.startup["compiled"], app.startup["templates"],
+                   now - forked_at - app.startup["templates"], now - started)
+    tornado.ioloop.IOLoop.current().start()
 
 
-http_server = tornado.httpserver.HTTPServer(Application())
-http_server.listen(options.port)
-tornado.ioloop.IOLoop.instance().start()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ __author__ = 'chenghao'
 
 from handler.user import urls as userUrls
 from handler.ver_code import urls as verCodeUrls
+from handler.monitor import urls as monitorUrls
 
 
-handlers_urls = userUrls + verCodeUrls
\ No newline at end of file
+handlers_urls = userUrls + verCodeUrls + monitorUrls
\ No newline at end of file
@@ -9,6 +9,10 @@ from config import logger
 import smtplib
 from email.mime.text import MIMEText
 import time
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
 
 
 # 格式化日期
@@ -47,12 +51,12 @@ def send_email(to_emails, user_name, link):
     try:
         smtp.connect(host, port)
     except Exception, e:
-        logger.error("连接163邮箱失败: " + str(e), exc_info=True)
+        logger.error("连接163邮箱失败: %s", e, exc_info=True)
     # login
     try:
         smtp.login(from_email, config.email_pwd)
     except Exception, e:
-        logger.error("登录163邮箱失败: " + str(e), exc_info=True)
+        logger.error("登录163邮箱失败: %s", e, exc_info=True)
 
     content = """<div>
                     <p>HI, %s  您找回密码的连接地址如下</p>
@@ -65,7 +69,7 @@ def send_email(to_emails, user_name, link):
     try:
         smtp.sendmail(from_email, to_emails, msg.as_string())
     except Exception, e:
-        logger.error("发送邮箱失败: " + str(e), exc_info=True)
+        logger.error("发送邮箱失败: %s", e, exc_info=True)
     finally:
         smtp.quit()
 
@@ -133,6 +137,26 @@ def compute_age(date_str):
     return age
 
 
+def utf8(s):
+    '''
+    Return s as a utf-8 str: unicode is encoded, anything else converted with str().
+    > utf8(u'\u7a0b')
+    '\xe7\xa8\x8b'
+    > utf8(12)
+    '12'
+    '''
+    return s.encode('utf-8') if isinstance(s, unicode) else str(s)
+
+
+def done_future(result):
+    '''
+    Return a Future already resolved to result, for methods returning a Future that sometimes have the result at hand.
+    '''
+    f = Future()
+    f.set_result(result)
+    return f
+
+
 class Dict(dict):
     '''
     Simple dict but support access as x.y style.
@@ -176,3 +200,91 @@ class Dict(dict):
 
     def __setattr__(self, key, value):
         self[key] = value
+
+    def __reduce__(self):
+        # without it pickle probes __getstate__ & co through __getattr__, raising an AttributeError each time.
+        return Dict, (), None, None, self.iteritems()
+
+
+class LRUCache(object):
+    '''
+    Thread-safe bounded mapping that evicts the least recently used keys.
+    A hit is a dict lookup plus a tick update and takes no lock, so it is cheaper than the work it usually saves.
+    When full, the oldest eighth of the keys are evicted in one go, which keeps eviction cost amortized O(log n).
+    With max_bytes, set() takes the size of each value and old keys are evicted until the total fits.
+    on_evict, if given, is called with each evicted key, under the lock.
+    hits and misses are counted without a lock and may be slightly off under concurrency.
+    > c = LRUCache(2)
+    > c.set('a', 1)
+    > c.set('b', 2)
+    > c.get('a')
+    1
+    > c.set('c', 3)
+    > c.get('b') is None
+    True
+    '''
+
+    def __init__(self, max_size=256, max_bytes=None, on_evict=None):
+        if max_size < 1:
+            raise ValueError('max_size must be positive.')
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = {}  # key -> [value, tick, nbytes]
+        self._tick = itertools.count()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        entry[1] = next(self._tick)
+        return entry[0]
+
+    def set(self, key, value, nbytes=0):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            if len(self._data) >= self.max_size:
+                self._evict(max(1, self.max_size // 8))
+            if self.max_bytes is not None:
+                while self._data and self.bytes + nbytes > self.max_bytes:
+                    self._evict(max(1, len(self._data) // 8))
+            self._data[key] = [value, next(self._tick), nbytes]
+            self.bytes += nbytes
+
+    def _evict(self, n):
+        for key in heapq.nsmallest(n, self._data, key=lambda k: self._data[k][1]):
+            self.bytes -= self._data.pop(key)[2]
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(key)
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return False
+            self.bytes -= entry[2]
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def keys(self):
+        return self._data.keys()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data